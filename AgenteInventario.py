@@ -10,8 +10,9 @@ from tools.inventario import (
     actualizar_producto,
     actualizar_stock
 )
-from tools.historial import cargar_historial, registrar_evento
+from tools.historial import ultimos_eventos, registrar_evento
 from tools.reportes import generar_reporte
+from tools.utils import ejecutar_mutacion
 
 load_dotenv()
 
@@ -31,21 +32,20 @@ def actualizar_precio(file_path: str, id: int, precio: float, usuario_actual: st
     Registra correctamente el historial.
     """
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    def _mutar(productos, data, indice):
+        producto = indice.get(int(id))
+        if not producto:
+            return None, None
 
-    productos = data["productos"]
-    producto = next((p for p in productos if p["id"] == id), None)
+        precio_anterior = producto["precio"]
+        producto["precio"] = float(precio)
+        return [int(id)], precio_anterior
 
-    if not producto:
-        return f"❌ El producto con ID {id} no existe."
-
-    precio_anterior = producto["precio"]
-    producto["precio"] = float(precio)
+    # Guardar inventario actualizado (se reintenta si otro proceso escribió antes)
+    precio_anterior = ejecutar_mutacion(file_path, _mutar)
 
-    # Guardar inventario actualizado
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    if precio_anterior is None:
+        return f"❌ El producto con ID {id} no existe."
 
     # Registrar historial
     registrar_evento(
@@ -123,6 +123,23 @@ def detectar_busqueda_producto(texto: str):
     return None
 
 
+def detectar_comando_historial(texto: str):
+    """
+    Reconoce "ver historial" / "historial", con filtro opcional
+    "producto <id>" o "usuario <nombre>". Devuelve los filtros (dict,
+    vacío si no hay) o None si el mensaje no es ese comando.
+    """
+    patron = r"^(?:ver\s+)?historial(?:\s+(producto|usuario)\s+(\S+))?$"
+    match = re.match(patron, texto.strip(), re.IGNORECASE)
+    if not match:
+        return None
+    if match.group(1) is None:
+        return {}
+    if match.group(1).lower() == "producto":
+        return {"producto_id": match.group(2)}
+    return {"usuario": match.group(2)}
+
+
 # ==========================================================
 #  VALIDACIÓN DE ARGUMENTOS
 # ==========================================================
@@ -167,9 +184,41 @@ tools = [
         "type": "function",
         "function": {
             "name": "leer_producto",
+            "description": (
+                "Busca productos por ID o por texto en nombre/categoría. "
+                "Las búsquedas por texto están paginadas e indican el total."
+            ),
             "parameters": {
                 "type": "object",
-                "properties": {"query": {"type": "string"}},
+                "properties": {
+                    "query": {"type": "string"},
+                    "limit": {
+                        "type": "integer",
+                        "description": "Máximo de resultados (por defecto 20, máximo 200)."
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "description": "Resultados a saltar, para pedir la página siguiente."
+                    },
+                    "campos": {
+                        "type": "array",
+                        "items": {
+                            "type": "string",
+                            "enum": ["id", "nombre", "precio", "stock", "categoria"]
+                        },
+                        "description": "Campos a devolver (por defecto todos)."
+                    },
+                    "compacto": {
+                        "type": "boolean",
+                        "description": "JSON en una línea, sin sangría."
+                    },
+                    "orden": {
+                        "type": "string",
+                        "enum": ["id", "nombre", "precio", "stock", "categoria",
+                                 "-id", "-nombre", "-precio", "-stock", "-categoria"],
+                        "description": "Campo de orden; con '-' delante, descendente."
+                    }
+                },
                 "required": ["query"]
             }
         }
@@ -258,13 +307,17 @@ def ejecutar_mensaje(mensaje_usuario: str, historial, rol_usuario="empleado", us
     # -------------------------------------------------------
     # 1️⃣ COMANDO LOCAL: VER HISTORIAL
     # -------------------------------------------------------
-    if mensaje_usuario.lower().strip() in ["ver historial", "historial"]:
-        eventos = cargar_historial()
+    filtros_historial = detectar_comando_historial(mensaje_usuario)
+    if filtros_historial is not None:
+        # Lectura desde el final del historial: no depende de su tamaño
+        eventos = ultimos_eventos(20, **filtros_historial)
         if not eventos:
+            if filtros_historial:
+                return {"tipo": "respuesta", "mensaje": "📭 No hay eventos para ese filtro."}
             return {"tipo": "respuesta", "mensaje": "📭 El historial está vacío."}
 
         texto = "📘 Historial reciente:\n\n"
-        for ev in eventos[-20:]:
+        for ev in eventos:
             texto += (
                 f"- {ev['fecha']} | {ev['usuario']} | {ev['accion']} | "
                 f"Producto {ev['producto_id']} | {ev['campo']}: "
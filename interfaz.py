@@ -1,13 +1,22 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import json
 import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from AgenteInventario import ejecutar_mensaje, TOOL_FUNCTIONS
 from tools.reportes import REPORTE_FILE, generar_reporte
+from tools.utils import version_inventario, obtener_derivado
+from tools.estadisticas import EstadisticasInventario
+from tools.importador import validar_csv, previsualizar_importacion, aplicar_importacion
+from tools.historial import consultar_historial, valores_historial, version_historial
+from tools.columnar import cargar_dataframe_inventario
 
 
 # ---------------------------------------------------
@@ -22,7 +31,129 @@ st.set_page_config(
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INVENTARIO_FILE = os.path.join(BASE_DIR, "productos.json")
 USERS_FILE = os.path.join(BASE_DIR, "usuarios.json")
-HISTORIAL_FILE = os.path.join(BASE_DIR, "historial.json")
+
+# Filas de las tablas de vista previa de importación que se envían al navegador
+MAX_FILAS_PREVIA = 1000
+
+# Tamaños de página de las tablas de inventario e historial
+TAMANOS_PAGINA = [25, 50, 100, 200]
+
+
+# ---------------------------------------------------
+# CAPA DE DATOS EN CACHÉ
+# ---------------------------------------------------
+# Los datos se cachean entre reruns y entre sesiones usando la versión del
+# archivo como clave: solo se recalculan cuando algo escribe en él. Los
+# DataFrames devueltos son COMPARTIDOS: filtrar/ordenar crea copias, pero
+# no deben modificarse en sitio.
+
+def columna_busqueda(df):
+    """
+    Texto en minúsculas de todas las celdas de cada fila, para buscar con
+    un único str.contains vectorizado. Las celdas se separan con un
+    carácter de control para que una búsqueda no una dos celdas.
+    """
+    if df.empty:
+        return pd.Series("", index=df.index, dtype=object)
+    texto = df[df.columns[0]].astype(str)
+    for col in df.columns[1:]:
+        texto = texto + "\x1f" + df[col].astype(str)
+    return texto.str.lower()
+
+
+def filtrar_texto(df, busqueda, columna):
+    """Filas de `df` cuya columna de búsqueda contiene el texto."""
+    return df[columna.str.contains(busqueda.lower(), regex=False)]
+
+
+def tabla_paginada(df, clave, posiciones=None, estilo=None):
+    """
+    Muestra `df` por páginas: solo la ventana visible se envía al
+    navegador. `posiciones` es el orden de las filas (posiciones iloc) ya
+    calculado; sin él se respeta el orden del DataFrame. `estilo(ventana)`
+    puede devolver un Styler para la ventana.
+    """
+    total = len(df)
+
+    c1, c2, c3 = st.columns([1, 1, 2])
+    tamano = c1.selectbox("Filas por página", TAMANOS_PAGINA, index=1, key=f"{clave}_tamano")
+    paginas = max(1, -(-total // tamano))
+
+    clave_pagina = f"{clave}_pagina"
+    if st.session_state.get(clave_pagina, 1) > paginas:
+        st.session_state[clave_pagina] = paginas
+    pagina = c2.number_input("Página", min_value=1, max_value=paginas, step=1, key=clave_pagina)
+
+    inicio = (pagina - 1) * tamano
+    fin = min(inicio + tamano, total)
+    c3.caption(f"Filas {inicio + 1 if total else 0}–{fin} de {total} · página {pagina} de {paginas}")
+
+    if posiciones is None:
+        ventana = df.iloc[inicio:fin]
+    else:
+        ventana = df.iloc[list(posiciones[inicio:fin])]
+
+    st.dataframe(estilo(ventana) if estilo else ventana, width="stretch")
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _leer_usuarios(version):
+    with open(USERS_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)["usuarios"]
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _inventario_df(version):
+    # Instantánea columnar (productos.instantanea.parquet) si pyarrow está instalado;
+    # si no, DataFrame a partir del inventario en caché
+    return cargar_dataframe_inventario(INVENTARIO_FILE)
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _inventario_busqueda(version):
+    return columna_busqueda(_inventario_df(version))
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _inventario_por_stock(version):
+    # Etiquetas de fila ordenadas por stock ascendente (orden estable)
+    df = _inventario_df(version)
+    return df.index[np.argsort(df["stock"].to_numpy(), kind="stable")]
+
+
+def inventario_df():
+    """
+    Versión del inventario y su DataFrame, compartido por las vistas.
+    La columna de búsqueda se pide aparte (_inventario_busqueda) y solo
+    si hay texto que buscar.
+    """
+    version = version_inventario(INVENTARIO_FILE)
+    return version, _inventario_df(version)
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _leer_csv_importacion(file_id, _archivo):
+    # Un CSV subido se lee y valida una sola vez, no en cada rerun
+    _archivo.seek(0)
+    df_csv = pd.read_csv(_archivo, dtype={"nombre": str, "categoria": str})
+    return df_csv, validar_csv(df_csv)
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _previa_importacion(file_id, version, _archivo):
+    # La vista previa depende además de la versión del inventario
+    df_csv, _ = _leer_csv_importacion(file_id, _archivo)
+    return previsualizar_importacion(INVENTARIO_FILE, df_csv)
+
+
+def orden_por_stock(df):
+    """
+    Posiciones de las filas de `df` (inventario, quizá filtrado) por stock
+    ascendente, a partir del orden precalculado: sin volver a ordenar.
+    """
+    orden = _inventario_por_stock(version_inventario(INVENTARIO_FILE))
+    posiciones = df.index.get_indexer(orden)
+    return posiciones[posiciones >= 0]
 
 
 # ---------------------------------------------------
@@ -33,8 +164,7 @@ def cargar_usuarios():
         st.error("No se encontró usuarios.json")
         st.stop()
 
-    with open(USERS_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)["usuarios"]
+    return _leer_usuarios(os.stat(USERS_FILE).st_mtime_ns)
 
 
 def autenticar(username, password):
@@ -48,23 +178,116 @@ def autenticar(username, password):
 # ---------------------------------------------------
 # FUNCIONES: HISTORIAL
 # ---------------------------------------------------
-def cargar_historial_seguro():
-    if not os.path.exists(HISTORIAL_FILE):
-        return []
+COLUMNAS_HISTORIAL = [
+    "usuario", "accion", "producto_id", "campo",
+    "valor_anterior", "valor_nuevo", "fecha"
+]
+
+# Periodos del filtro del historial (días; None = todo). Los meses
+# cerrados del historial solo se leen si el periodo los incluye.
+PERIODOS_HISTORIAL = {
+    "Últimos 30 días": 30,
+    "Últimos 90 días": 90,
+    "Último año": 365,
+    "Todo": None,
+}
+
+
+# Consultas del historial en caché (combinaciones de filtros distintas)
+MAX_CONSULTAS_HISTORIAL = 8
+
+
+@st.cache_resource(show_spinner=False)
+def _consultas_historial():
+    # Compartido por todas las sesiones. Solo guarda consultas de la
+    # versión actual del historial: cada evento nuevo cambia la versión,
+    # y con ella como clave de st.cache_* quedarían en memoria tablas
+    # completas de versiones viejas.
+    return {"lock": threading.Lock(), "version": None, "consultas": OrderedDict()}
 
+
+def _consulta_historial(version, filtros):
+    cache = _consultas_historial()
+    with cache["lock"]:
+        if cache["version"] != version:
+            cache["version"] = version
+            cache["consultas"].clear()
+        entrada = cache["consultas"].get(filtros)
+        if entrada is None:
+            desde, usuario, accion, campo, producto_id = filtros
+            # En orden cronológico (índices del historial)
+            historial = consultar_historial(
+                desde=desde, usuario=usuario, accion=accion, campo=campo, producto_id=producto_id
+            )
+            entrada = {"df": pd.DataFrame(historial, columns=COLUMNAS_HISTORIAL), "busqueda": None}
+            cache["consultas"][filtros] = entrada
+            if len(cache["consultas"]) > MAX_CONSULTAS_HISTORIAL:
+                cache["consultas"].popitem(last=False)
+        else:
+            cache["consultas"].move_to_end(filtros)
+        return entrada
+
+
+def _historial_df(version, *filtros):
+    return _consulta_historial(version, filtros)["df"]
+
+
+def _historial_busqueda(version, *filtros):
+    entrada = _consulta_historial(version, filtros)
+    if entrada["busqueda"] is None:
+        entrada["busqueda"] = columna_busqueda(entrada["df"])
+    return entrada["busqueda"]
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _hay_eventos_anteriores(version, desde, usuario, accion, campo, producto_id):
+    # Basta con el último evento anterior al periodo que cumpla los filtros
+    return bool(consultar_historial(
+        hasta=desde, ultimos=1,
+        usuario=usuario, accion=accion, campo=campo, producto_id=producto_id
+    ))
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _opciones_historial(version):
+    opciones = {c: sorted(valores_historial(c)) for c in ("usuario", "accion", "campo")}
+    opciones["producto_id"] = sorted(
+        valores_historial("producto_id"),
+        key=lambda v: (0, int(v), "") if v.isdigit() else (1, 0, v)
+    )
+    return opciones
+
+
+def cargar_historial_seguro(desde=None, usuario=None, accion=None, campo=None, producto_id=None, texto=""):
+    """
+    Eventos filtrados (DataFrame). Con `texto` se filtran además por
+    contenido; la columna de búsqueda solo se construye en ese caso.
+    """
     try:
-        with open(HISTORIAL_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        clave = (version_historial(), desde, usuario, accion, campo, producto_id)
+        df = _historial_df(*clave)
+        if texto:
+            df = filtrar_texto(df, texto, _historial_busqueda(*clave))
+        return df
+    except:
+        return pd.DataFrame(columns=COLUMNAS_HISTORIAL)
 
-        if isinstance(data, dict) and "historial" in data:
-            return data["historial"]
 
-        if isinstance(data, list):
-            return data
+def hay_eventos_anteriores_seguro(desde, usuario=None, accion=None, campo=None, producto_id=None):
+    """True si el periodo elegido deja fuera eventos que cumplen los filtros."""
+    if desde is None:
+        return False
+    try:
+        return _hay_eventos_anteriores(version_historial(), desde, usuario, accion, campo, producto_id)
+    except:
+        return False
+
 
-        return []
+def cargar_opciones_historial_seguro():
+    try:
+        return _opciones_historial(version_historial())
     except:
-        return []
+        return {"usuario": [], "accion": [], "campo": [], "producto_id": []}
 
 
 # ---------------------------------------------------
@@ -138,17 +361,23 @@ if "accion_pendiente" not in st.session_state:
 
 
 # ---------------------------------------------------
-# PESTAÑAS
+# VISTAS
 # ---------------------------------------------------
-tab_chat, tab_inventario, tab_dashboard, tab_historial = st.tabs(
-    ["Chat", "Inventario", "Dashboard", "Historial"]
+# Con st.tabs se ejecutaban las cuatro pestañas en cada rerun aunque solo
+# se viera una; con el selector solo se calcula la vista activa.
+vista = st.radio(
+    "Vista",
+    ["Chat", "Inventario", "Dashboard", "Historial"],
+    horizontal=True,
+    key="vista",
+    label_visibility="collapsed"
 )
 
 
 # ======================================================
-# TAB 1: CHAT
+# VISTA 1: CHAT
 # ======================================================
-with tab_chat:
+if vista == "Chat":
 
     st.subheader(f"Sesión iniciada como: {st.session_state.usuario['rol'].upper()}")
 
@@ -263,17 +492,13 @@ with tab_chat:
 
 
 # ======================================================
-# TAB 2: INVENTARIO
+# VISTA 2: INVENTARIO
 # ======================================================
-with tab_inventario:
+elif vista == "Inventario":
 
     st.header("Inventario")
 
-    with open(INVENTARIO_FILE, "r", encoding="utf-8") as f:
-        raw = json.load(f)
-
-    productos = raw["productos"]
-    df = pd.DataFrame(productos)
+    version_inv, df = inventario_df()
 
     # -------------------------------
     # 📄 REPORTE PDF
@@ -296,6 +521,57 @@ with tab_inventario:
     else:
         st.info("Solo los administradores pueden generar reportes.")
 
+    # -------------------------------
+    # 📥 IMPORTACIÓN CSV (CON VISTA PREVIA)
+    # -------------------------------
+    if st.session_state.usuario["rol"] == "admin":
+        with st.expander("📥 Importar productos desde CSV"):
+            archivo_csv = st.file_uploader("Archivo CSV", type=["csv"], key="csv_import")
+
+            if archivo_csv is not None:
+                # Lectura, validación y vista previa en caché por archivo
+                # subido y versión del inventario: buscar o paginar la
+                # tabla no las repite
+                df_csv, errores = _leer_csv_importacion(archivo_csv.file_id, archivo_csv)
+
+                if errores:
+                    st.error("El CSV tiene errores:\n- " + "\n- ".join(errores))
+                else:
+                    previa = _previa_importacion(
+                        archivo_csv.file_id, version_inventario(INVENTARIO_FILE), archivo_csv
+                    )
+                    resumen = previa["resumen"]
+
+                    c1, c2, c3, c4 = st.columns(4)
+                    c1.metric("Filas", resumen["filas"])
+                    c2.metric("Nuevos", resumen["nuevos"])
+                    c3.metric("Actualizados", resumen["actualizados"])
+                    c4.metric("Sin cambios", resumen["sin_cambios"])
+
+                    if resumen["campos_modificados"]:
+                        st.write("Campos modificados:", resumen["campos_modificados"])
+
+                    if not previa["precios_por_categoria"].empty:
+                        st.subheader("Cambios de precio por categoría")
+                        st.dataframe(previa["precios_por_categoria"])
+
+                    # Solo se envía al navegador una muestra de las tablas
+                    if not previa["cambios"].empty:
+                        st.subheader(f"Cambios ({len(previa['cambios'])})")
+                        st.dataframe(previa["cambios"].head(MAX_FILAS_PREVIA))
+
+                    if not previa["nuevos"].empty:
+                        st.subheader(f"Productos nuevos ({len(previa['nuevos'])})")
+                        st.dataframe(previa["nuevos"].head(MAX_FILAS_PREVIA))
+
+                    if st.button("Aplicar importación"):
+                        resultado = aplicar_importacion(
+                            INVENTARIO_FILE,
+                            df_csv,
+                            usuario=st.session_state.usuario["username"]
+                        )
+                        st.success(resultado)
+
     st.divider()
 
     # -------------------------------
@@ -308,10 +584,7 @@ with tab_inventario:
         busqueda = st.text_input("Buscar por nombre, categoría o ID", key="busqueda_inv")
 
         if busqueda:
-            df = df[df.apply(
-                lambda r: r.astype(str).str.contains(busqueda, case=False).any(),
-                axis=1
-            )]
+            df = filtrar_texto(df, busqueda, _inventario_busqueda(version_inv))
 
         # 🏷 FILTRO POR CATEGORÍA
         categorias = ["Todas"] + sorted(df["categoria"].unique())
@@ -320,10 +593,9 @@ with tab_inventario:
         if cat != "Todas":
             df = df[df["categoria"] == cat]
 
-        # 🔼 ORDENAR POR STOCK
+        # 🔼 ORDENAR POR STOCK (orden precalculado por versión)
         ordenar = st.checkbox("Ordenar por stock ascendente", key="ordenar_inv")
-        if ordenar:
-            df = df.sort_values(by="stock", ascending=True)
+        posiciones = orden_por_stock(df) if ordenar else None
 
         # 🔥 COLOREAR STOCK BAJO
         def estilo_stock(v):
@@ -334,7 +606,10 @@ with tab_inventario:
                 pass
             return ""
 
-        st.dataframe(df.style.map(estilo_stock, subset=["stock"]), width="stretch")
+        tabla_paginada(
+            df, "tabla_inv", posiciones=posiciones,
+            estilo=lambda v: v.style.map(estilo_stock, subset=["stock"])
+        )
 
         # ---------------------------------
         # 🔼 ACTUALIZAR PRECIO (SUPERVISOR/ADMIN)
@@ -372,45 +647,49 @@ with tab_inventario:
 
 
 # ======================================================
-# TAB 3: DASHBOARD + BOTÓN DE DESCARGA PDF
+# VISTA 3: DASHBOARD + BOTÓN DE DESCARGA PDF
 # ======================================================
-with tab_dashboard:
+elif vista == "Dashboard":
 
     st.header("Dashboard")
 
-    # Cargar inventario
-    with open(INVENTARIO_FILE, "r", encoding="utf-8") as f:
-        raw = json.load(f)
+    # Mismo DataFrame (en caché) que la pestaña Inventario
+    _, df = inventario_df()
 
-    productos = raw["productos"] if isinstance(raw, dict) else raw
-    df = pd.DataFrame(productos)
+    # Agregados mantenidos de forma incremental por las herramientas que
+    # escriben el inventario (ver tools/estadisticas.py)
+    estadisticas = obtener_derivado(INVENTARIO_FILE, "estadisticas", EstadisticasInventario)
+    resumen = estadisticas.resumen()
 
     # ============================
     # MÉTRICAS SUPERIORES
     # ============================
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Stock total", int(df["stock"].sum()))
-    col2.metric("Categorías", df["categoria"].nunique())
-    col3.metric("Productos", df.shape[0])
-    col4.metric("Críticos (≤5)", df[df["stock"] <= 5].shape[0])
+    col1.metric("Stock total", resumen["stock_total"])
+    col2.metric("Categorías", resumen["categorias"])
+    col3.metric("Productos", resumen["productos"])
+    col4.metric("Críticos (≤5)", resumen["criticos"])
 
     # ============================
     # GRÁFICO: Stock por categoría
     # ============================
     st.subheader("Stock por categoría")
-    st.bar_chart(df.groupby("categoria")["stock"].sum())
+    st.bar_chart(
+        pd.Series(estadisticas.stock_por_categoria(), name="stock", dtype="int64")
+        .rename_axis("categoria")
+    )
 
     # ============================
     # TABLA: Productos con menos stock
     # ============================
     st.subheader("Menos stock")
-    st.dataframe(df.sort_values(by="stock").head(10))
+    st.dataframe(pd.DataFrame(estadisticas.menos_stock(10), columns=list(df.columns)))
 
     # ============================
     # TABLA: Productos con más stock
     # ============================
     st.subheader("Más stock")
-    st.dataframe(df.sort_values(by="stock", ascending=False).head(10))
+    st.dataframe(pd.DataFrame(estadisticas.mas_stock(10), columns=list(df.columns)))
 
     # ============================
     # GRÁFICO: Tendencia general por nombre
@@ -439,109 +718,93 @@ with tab_dashboard:
 
 
 # ======================================================
-# TAB 4: HISTORIAL
+# VISTA 4: HISTORIAL
 # ======================================================
-with tab_historial:
+elif vista == "Historial":
 
     st.header("Historial de Cambios")
 
-    historial = cargar_historial_seguro()
+    # Las opciones de los filtros salen de los índices del historial y la
+    # consulta solo lee los eventos que cumplen los filtros
+    opciones = cargar_opciones_historial_seguro()
 
-    if not historial:
+    if not opciones["accion"]:
         st.info("Aún no hay eventos registrados.")
     else:
-        hist_df = pd.DataFrame(historial)
-
-        columnas_necesarias = {
-            "usuario", "accion", "producto_id", "campo",
-            "valor_anterior", "valor_nuevo", "fecha"
-        }
-
-        faltan = columnas_necesarias - set(hist_df.columns)
-
-        if faltan:
-            st.error(f"Faltan columnas: {faltan}")
-            st.write(hist_df)
-        else:
-            st.subheader("Filtros del historial")
-
-            col1, col2, col3 = st.columns(3)
-
-            # ------------------------
-            # FILTRO POR USUARIO
-            # ------------------------
-            with col1:
-                usuario_sel = st.selectbox(
-                    "Usuario",
-                    ["Todos"] + sorted(hist_df["usuario"].unique())
-                )
-
-            # ------------------------
-            # FILTRO POR ACCIÓN
-            # ------------------------
-            with col2:
-                accion_sel = st.selectbox(
-                    "Acción",
-                    ["Todas"] + sorted(hist_df["accion"].unique())
-                )
-
-            # ------------------------
-            # FILTRO POR CAMPO
-            # ------------------------
-            with col3:
-                campo_sel = st.selectbox(
-                    "Campo modificado",
-                    ["Todos"] + sorted(hist_df["campo"].unique())
-                )
-
-            col4, col5 = st.columns(2)
-
-            # ------------------------
-            # FILTRO POR ID PRODUCTO
-            # ------------------------
-            with col4:
-                ids = ["Todos"] + sorted(map(str, hist_df["producto_id"].unique()))
-                id_sel = st.selectbox("ID Producto", ids)
-
-            # ------------------------
-            # BÚSQUEDA DE TEXTO
-            # ------------------------
-            with col5:
-                texto_busqueda = st.text_input("Buscar texto en cualquier campo")
-
-            # ------------------------
-            # APLICAR FILTROS
-            # ------------------------
-            df_filtrado = hist_df.copy()
-
-            if usuario_sel != "Todos":
-                df_filtrado = df_filtrado[df_filtrado["usuario"] == usuario_sel]
-
-            if accion_sel != "Todas":
-                df_filtrado = df_filtrado[df_filtrado["accion"] == accion_sel]
-
-            if campo_sel != "Todos":
-                df_filtrado = df_filtrado[df_filtrado["campo"] == campo_sel]
-
-            if id_sel != "Todos":
-                df_filtrado = df_filtrado[df_filtrado["producto_id"] == int(id_sel)]
+        st.subheader("Filtros del historial")
+
+        col1, col2, col3 = st.columns(3)
+
+        # ------------------------
+        # FILTRO POR USUARIO
+        # ------------------------
+        with col1:
+            usuario_sel = st.selectbox("Usuario", ["Todos"] + opciones["usuario"])
+
+        # ------------------------
+        # FILTRO POR ACCIÓN
+        # ------------------------
+        with col2:
+            accion_sel = st.selectbox("Acción", ["Todas"] + opciones["accion"])
+
+        # ------------------------
+        # FILTRO POR CAMPO
+        # ------------------------
+        with col3:
+            campo_sel = st.selectbox("Campo modificado", ["Todos"] + opciones["campo"])
+
+        col4, col5, col6 = st.columns(3)
+
+        # ------------------------
+        # FILTRO POR PERIODO
+        # ------------------------
+        with col6:
+            periodo_sel = st.selectbox("Periodo", list(PERIODOS_HISTORIAL))
+
+        # ------------------------
+        # FILTRO POR ID PRODUCTO
+        # ------------------------
+        with col4:
+            id_sel = st.selectbox("ID Producto", ["Todos"] + opciones["producto_id"])
+
+        # ------------------------
+        # BÚSQUEDA DE TEXTO
+        # ------------------------
+        with col5:
+            texto_busqueda = st.text_input("Buscar texto en cualquier campo")
+
+        # ------------------------
+        # APLICAR FILTROS (índices del historial)
+        # ------------------------
+        # Desde el inicio del día, para que la consulta en caché sirva
+        # durante todo el día
+        dias = PERIODOS_HISTORIAL[periodo_sel]
+        filtros = dict(
+            desde=(datetime.now() - timedelta(days=dias)).strftime("%Y-%m-%d 00:00:00") if dias else None,
+            usuario=None if usuario_sel == "Todos" else usuario_sel,
+            accion=None if accion_sel == "Todas" else accion_sel,
+            campo=None if campo_sel == "Todos" else campo_sel,
+            producto_id=None if id_sel == "Todos" else id_sel,
+        )
+        df_filtrado = cargar_historial_seguro(**filtros, texto=texto_busqueda)
 
-            if texto_busqueda:
-                df_filtrado = df_filtrado[
-                    df_filtrado.apply(
-                        lambda r: texto_busqueda.lower() in r.astype(str).str.lower().to_string(),
-                        axis=1
-                    )
-                ]
-
-            # ------------------------
-            # MOSTRAR RESULTADO
-            # ------------------------
-            st.subheader("Resultados del historial")
-            st.dataframe(
-                df_filtrado.sort_values(by="fecha", ascending=False),
-                use_container_width=True
+        # El periodo por defecto oculta los eventos antiguos: avisarlo
+        if hay_eventos_anteriores_seguro(**filtros):
+            st.info(
+                f"Se muestran los eventos desde el {filtros['desde'][:10]}. "
+                "Hay eventos anteriores: elige «Todo» en Periodo para verlos."
             )
 
+        # ------------------------
+        # MOSTRAR RESULTADO
+        # ------------------------
+        st.subheader("Resultados del historial")
+        # El historial ya viene ordenado por fecha: el más reciente primero
+        # es recorrerlo al revés, sin ordenar ni copiar la tabla
+        tabla_paginada(
+            df_filtrado, "tabla_hist",
+            posiciones=range(len(df_filtrado) - 1, -1, -1)
+        )
+
 
 #python -m streamlit run interfaz.py
\ No newline at end of file
@@ -0,0 +1,170 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from tools.almacenamiento import obtener_almacenamiento
+from tools.utils import (
+    cargar_inventario, ejecutar_mutacion, invalidar_cache, obtener_derivado, version_inventario,
+)
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def _crear_inventario(ruta):
+    data = {"productos": [
+        {"id": 1, "nombre": "Tornillo", "precio": 1.0, "stock": 10, "categoria": "Ferretería"},
+        {"id": 2, "nombre": "Tuerca", "precio": 0.5, "stock": 137, "categoria": "Ferretería"},
+    ]}
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def _stock_en_disco(ruta, pid):
+    with open(ruta, encoding="utf-8") as f:
+        return next(p["stock"] for p in json.load(f)["productos"] if p["id"] == pid)
+
+
+def test_recarga_durante_mutacion_no_pisa_escritura_de_otro_proceso(tmp_path, monkeypatch):
+    monkeypatch.delenv("INVENTARIO_BACKEND", raising=False)
+    ruta = str(tmp_path / "productos.json")
+    _crear_inventario(ruta)
+    invalidar_cache()
+
+    cargado = threading.Event()
+    continuar = threading.Event()
+    intentos = []
+
+    def _mutar(productos, data, indice):
+        intentos.append(1)
+        if len(intentos) == 1:
+            cargado.set()
+            continuar.wait(10)
+        indice[1]["stock"] += 1
+        return [1], None
+
+    errores = []
+
+    def _hilo():
+        try:
+            ejecutar_mutacion(ruta, _mutar)
+        except Exception as e:  # pragma: no cover - se comprueba abajo
+            errores.append(e)
+
+    hilo = threading.Thread(target=_hilo)
+    hilo.start()
+    assert cargado.wait(10)
+
+    # Otro proceso guarda el producto 2 mientras la mutación está en curso
+    codigo = (
+        "import sys; from tools.utils import ejecutar_mutacion;"
+        "ejecutar_mutacion(sys.argv[1], lambda p, d, i: (i[2].update(stock=222) or [2], None))"
+    )
+    subprocess.run([sys.executable, "-c", codigo, ruta], cwd=RAIZ, check=True)
+
+    # Una lectura de este proceso (otra sesión) sustituye la entrada de caché
+    productos, _ = cargar_inventario(ruta)
+    assert next(p["stock"] for p in productos if p["id"] == 2) == 222
+
+    continuar.set()
+    hilo.join(10)
+
+    assert not errores
+    assert len(intentos) == 2
+    assert _stock_en_disco(ruta, 2) == 222
+    assert _stock_en_disco(ruta, 1) == 11
+
+
+def test_guardado_fallido_no_deja_cambios_en_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv("INVENTARIO_BACKEND", raising=False)
+    ruta = str(tmp_path / "productos.json")
+    _crear_inventario(ruta)
+    invalidar_cache()
+
+    cargar_inventario(ruta)
+    version = version_inventario(ruta)
+    vistos = []
+
+    def _guardar_bloqueado(*args, **kwargs):
+        # Otro proceso tiene el bloqueo de escritura todo el tiempo
+        productos, _ = cargar_inventario(ruta)
+        vistos.append(next(p["stock"] for p in productos if p["id"] == 2))
+        raise TimeoutError("bloqueo ocupado")
+
+    monkeypatch.setattr(obtener_almacenamiento(), "guardar", _guardar_bloqueado)
+
+    def _mutar(productos, data, indice):
+        indice[2]["stock"] = 99999
+        return [2], None
+
+    with pytest.raises(TimeoutError):
+        ejecutar_mutacion(ruta, _mutar)
+
+    # Ni durante la espera ni después se ve el cambio no guardado
+    assert vistos == [137]
+    productos, _ = cargar_inventario(ruta)
+    assert next(p["stock"] for p in productos if p["id"] == 2) == 137
+    assert version_inventario(ruta) == version
+
+
+class _Stocks:
+    def __init__(self, productos):
+        self.stock = {p["id"]: p["stock"] for p in productos}
+
+    def actualizar(self, productos):
+        self.stock.update((p["id"], p["stock"]) for p in productos)
+
+
+def test_construir_derivado_no_bloquea_mutaciones(tmp_path, monkeypatch):
+    monkeypatch.delenv("INVENTARIO_BACKEND", raising=False)
+    ruta = str(tmp_path / "productos.json")
+    _crear_inventario(ruta)
+    invalidar_cache()
+
+    construyendo = threading.Event()
+    continuar = threading.Event()
+    construidos = []
+
+    def _construir(productos):
+        construidos.append(1)
+        if len(construidos) == 1:
+            construyendo.set()
+            continuar.wait(10)
+        return _Stocks(productos)
+
+    resultado = []
+    hilo = threading.Thread(target=lambda: resultado.append(obtener_derivado(ruta, "stocks", _construir)))
+    hilo.start()
+    assert construyendo.wait(10)
+
+    # La mutación termina mientras la estructura se está construyendo
+    mutacion = threading.Thread(
+        target=ejecutar_mutacion, args=(ruta, lambda p, d, i: (i[2].update(stock=5) or [2], None))
+    )
+    mutacion.start()
+    mutacion.join(5)
+    assert not mutacion.is_alive()
+
+    continuar.set()
+    hilo.join(10)
+
+    # Lo construido sobre la versión anterior se descarta y se rehace
+    assert len(construidos) == 2
+    assert resultado[0].stock[2] == 5
+    assert obtener_derivado(ruta, "stocks", _construir) is resultado[0]
+
+
+def test_inventario_inexistente(tmp_path, monkeypatch):
+    invalidar_cache()
+
+    monkeypatch.delenv("INVENTARIO_BACKEND", raising=False)
+    with pytest.raises(FileNotFoundError, match="no existe"):
+        cargar_inventario(str(tmp_path / "productos.json"))
+
+    # Sin migrar, el motor SQLite indica cómo crear la base de datos
+    monkeypatch.setenv("INVENTARIO_BACKEND", "sqlite")
+    with pytest.raises(FileNotFoundError, match="python -m tools.almacenamiento migrar"):
+        cargar_inventario(str(tmp_path / "productos.json"))
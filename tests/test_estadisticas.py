@@ -0,0 +1,28 @@
+import random
+
+from tools.estadisticas import EstadisticasInventario
+
+
+def test_menos_y_mas_stock_tras_muchas_actualizaciones():
+    azar = random.Random(7)
+    productos = {
+        i: {"id": i, "nombre": f"p{i}", "precio": 1.0, "stock": azar.randint(0, 20), "categoria": "c"}
+        for i in range(200)
+    }
+    estadisticas = EstadisticasInventario(productos.values())
+
+    for _ in range(50):
+        cambiados = []
+        for pid in azar.sample(range(250), 30):
+            p = {"id": pid, "nombre": f"p{pid}", "precio": 1.0, "stock": azar.randint(0, 20), "categoria": "c"}
+            productos[pid] = p
+            cambiados.append(p)
+        estadisticas.actualizar(cambiados)
+
+        orden = sorted(productos.values(), key=lambda p: (p["stock"], p["id"]))
+        assert estadisticas.menos_stock(10) == orden[:10]
+        assert estadisticas.mas_stock(10) == orden[::-1][:10]
+        assert estadisticas.resumen()["stock_total"] == sum(p["stock"] for p in orden)
+
+    # Los montículos no crecen sin límite con entradas obsoletas
+    assert len(estadisticas._menores) <= 2 * len(productos) + 30
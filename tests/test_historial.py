@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from tools.historial import EscritorAsincrono
+
+
+class _Destino:
+    """Función de escritura que anota los lotes y puede fallar o bloquearse."""
+
+    def __init__(self, fallos=0):
+        self.lotes = []
+        self.fallos = fallos
+        self.intentos = 0
+        self.entrar = threading.Event()
+        self.salir = threading.Event()
+        self.salir.set()
+
+    def __call__(self, eventos, fsync):
+        self.intentos += 1
+        self.entrar.set()
+        self.salir.wait(10)
+        if self.fallos:
+            self.fallos -= 1
+            raise OSError("disco lleno")
+        self.lotes.append(list(eventos))
+
+    @property
+    def eventos(self):
+        return [e for lote in self.lotes for e in lote]
+
+
+def test_agrupa_eventos_en_lotes():
+    destino = _Destino()
+    escritor = EscritorAsincrono(destino, intervalo=0.2, lote_max=2, cola_max=10)
+    for i in range(5):
+        escritor.encolar([i])
+    escritor.vaciar()
+
+    assert destino.eventos == [0, 1, 2, 3, 4]
+    assert [len(lote) for lote in destino.lotes] == [2, 2, 1]
+    escritor.detener()
+
+
+def test_detener_escribe_lo_pendiente():
+    destino = _Destino()
+    escritor = EscritorAsincrono(destino, intervalo=10, lote_max=100, cola_max=100)
+    escritor.encolar([1, 2])
+    escritor.encolar([3])
+    escritor.detener()
+
+    assert destino.eventos == [1, 2, 3]
+    assert not escritor._hilo.is_alive()
+
+
+def test_detener_escribe_lo_encolado_tras_parar_el_hilo():
+    destino = _Destino()
+    destino.salir.clear()
+    escritor = EscritorAsincrono(destino, intervalo=0.01, lote_max=3, cola_max=3)
+    escritor.encolar([1])
+    assert destino.entrar.wait(10)
+
+    # Mientras se escribe el primer lote se pide parar y llega otro lote
+    parada = threading.Thread(target=escritor.detener)
+    parada.start()
+    while escritor._cola.empty():
+        time.sleep(0.001)
+    escritor.encolar([2, 3])
+    destino.salir.set()
+    parada.join(10)
+
+    assert destino.eventos == [1, 2, 3]
+    assert escritor._pendientes == 0
+    # Se devuelven los huecos de la cola de todo lo escrito
+    for _ in range(3):
+        assert escritor._hueco.acquire(blocking=False)
+
+
+def test_reintenta_tras_un_fallo_y_vaciar_lanza_el_error():
+    destino = _Destino(fallos=1)
+    escritor = EscritorAsincrono(destino, intervalo=0.05, lote_max=100, cola_max=100)
+    escritor.encolar([1, 2])
+
+    with pytest.raises(OSError, match="disco lleno"):
+        escritor.vaciar()
+
+    limite = time.monotonic() + 10
+    while not destino.lotes and time.monotonic() < limite:
+        time.sleep(0.01)
+    escritor.vaciar()
+
+    assert destino.intentos == 2
+    assert destino.eventos == [1, 2]
+    escritor.detener()
+
+
+def test_detener_reintenta_el_lote_fallido():
+    destino = _Destino(fallos=1)
+    escritor = EscritorAsincrono(destino, intervalo=10, lote_max=100, cola_max=100)
+    escritor.encolar([1])
+
+    # El hilo falla al escribir su último lote; detener() lo vuelve a intentar
+    escritor.detener()
+
+    assert destino.intentos == 2
+    assert destino.eventos == [1]
+    assert escritor._pendientes == 0
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import tools.importador as importador
+from tools import historial
+from tools.utils import cargar_inventario, invalidar_cache
+
+
+def _preparar(tmp_path, monkeypatch):
+    monkeypatch.delenv("INVENTARIO_BACKEND", raising=False)
+    monkeypatch.setattr(historial, "HISTORIAL_LOG", str(tmp_path / "historial.jsonl"))
+    ruta = str(tmp_path / "productos.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump({"productos": [
+            {"id": 1, "nombre": "Tornillo", "precio": 1.0, "stock": 10, "categoria": "Ferretería"},
+        ]}, f)
+    ruta_csv = str(tmp_path / "entrada.csv")
+    with open(ruta_csv, "w", encoding="utf-8") as f:
+        f.write("id,nombre,precio,stock,categoria\n")
+        f.write("1,Tornillo,1.0,11,Ferretería\n")
+        f.write("2,Tuerca,0.5,5,Ferretería\n")
+        f.write("3,Arandela,0.1,7,Ferretería\n")
+    invalidar_cache()
+    return ruta, ruta_csv
+
+
+def _eventos(tmp_path):
+    with open(tmp_path / "historial.jsonl", encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def test_caida_tras_guardar_inventario_no_pierde_eventos(tmp_path, monkeypatch):
+    ruta, ruta_csv = _preparar(tmp_path, monkeypatch)
+
+    # El proceso cae después de guardar el inventario del primer bloque
+    # y antes de guardar el avance
+    def _caida(*args):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as m:
+        m.setattr(importador, "_avanzar", _caida)
+        with pytest.raises(KeyboardInterrupt):
+            importador.importar_csv_por_bloques(ruta, ruta_csv, tamano_bloque=2)
+    assert {p["id"] for p in cargar_inventario(ruta)[0]} == {1, 2}
+
+    resultado = importador.importar_csv_por_bloques(ruta, ruta_csv, tamano_bloque=2)
+    assert "2 nuevos, 1 actualizados" in resultado
+    assert "(3 filas en 2 bloques)" in resultado
+
+    eventos = _eventos(tmp_path)
+    assert [e for e in eventos if e["accion"] == "importar_masivo"] == [
+        {**eventos[0], "producto_id": 1, "campo": "stock", "valor_anterior": 10, "valor_nuevo": 11},
+    ]
+    nuevos = {e["producto_id"] for e in eventos if e["accion"] == "importar_nuevo_producto"}
+    assert nuevos == {2, 3}
+
+
+def test_caida_antes_de_guardar_inventario_repite_el_bloque(tmp_path, monkeypatch):
+    ruta, ruta_csv = _preparar(tmp_path, monkeypatch)
+
+    anotar = importador._anotar_bloque
+
+    # Los eventos quedan anotados, pero el inventario no llega a guardarse
+    def _caida(*args):
+        anotar(*args)
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as m:
+        m.setattr(importador, "_anotar_bloque", _caida)
+        with pytest.raises(KeyboardInterrupt):
+            importador.importar_csv_por_bloques(ruta, ruta_csv, tamano_bloque=2)
+    assert {p["id"] for p in cargar_inventario(ruta)[0]} == {1}
+
+    resultado = importador.importar_csv_por_bloques(ruta, ruta_csv, tamano_bloque=2)
+    assert "2 nuevos, 1 actualizados" in resultado
+    assert len([e for e in _eventos(tmp_path) if e["accion"] == "importar_masivo"]) == 1
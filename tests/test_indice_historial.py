@@ -0,0 +1,73 @@
+import json
+
+from tools.almacenamiento import AlmacenamientoJSON
+
+
+def _eventos(desde, n):
+    return [{
+        "usuario": f"u{i % 2}", "accion": "actualizar_stock", "producto_id": i,
+        "campo": "stock", "valor_anterior": i, "valor_nuevo": i + 1,
+        "fecha": f"2026-10-01 10:00:{i % 60:02d}",
+    } for i in range(desde, desde + n)]
+
+
+def _lotes(ruta_idx):
+    with open(ruta_idx, "rb") as f:
+        return [json.loads(linea) for linea in f if linea.strip()][1:]
+
+
+def test_diario_compartido_por_dos_procesos_no_se_bifurca(tmp_path):
+    ruta = str(tmp_path / "historial.jsonl")
+    # Cada motor tiene su propio índice en memoria, como dos procesos
+    a, b = AlmacenamientoJSON(), AlmacenamientoJSON()
+
+    a.anexar_eventos(ruta, _eventos(0, 3))
+    a.consultar_eventos(ruta)
+    a.persistir_indices()
+
+    b.consultar_eventos(ruta)
+    a.anexar_eventos(ruta, _eventos(3, 3))
+    a.consultar_eventos(ruta)
+    b.consultar_eventos(ruta)
+    a.persistir_indices()
+    b.persistir_indices()   # ya está en el diario: no añade otro lote
+
+    a.anexar_eventos(ruta, _eventos(6, 3))
+    b.consultar_eventos(ruta)
+    a.consultar_eventos(ruta)
+    b.persistir_indices()
+    a.persistir_indices()
+
+    assert [lote["desde"] for lote in _lotes(ruta + ".idx")] == [0, 3, 6]
+
+    c = AlmacenamientoJSON()
+    indice = c._indice_historial(ruta)
+    assert indice.guardados == 9
+    assert len(c.consultar_eventos(ruta, usuario="u1")) == 4
+    assert indice.sin_persistir == 0
+
+
+def test_diario_bifurcado_se_reescribe_entero(tmp_path):
+    ruta = str(tmp_path / "historial.jsonl")
+    a = AlmacenamientoJSON()
+    a.anexar_eventos(ruta, _eventos(0, 3))
+    a.consultar_eventos(ruta)
+    a.persistir_indices()
+    a.anexar_eventos(ruta, _eventos(3, 3))
+    a.consultar_eventos(ruta)
+    a.persistir_indices()
+
+    # Un lote repetido (dos procesos sin bloqueo) y otro detrás de él
+    with open(ruta + ".idx", "rb") as f:
+        lineas = f.readlines()
+    with open(ruta + ".idx", "ab") as f:
+        f.write(lineas[-1])
+
+    b = AlmacenamientoJSON()
+    indice = b._indice_historial(ruta)
+    assert indice.guardados == 0 and indice.diario is None
+    b.consultar_eventos(ruta)
+    b.persistir_indices()
+
+    assert [lote["desde"] for lote in _lotes(ruta + ".idx")] == [0]
+    assert AlmacenamientoJSON()._indice_historial(ruta).guardados == 6
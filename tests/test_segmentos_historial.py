@@ -0,0 +1,86 @@
+import gzip
+import json
+import os
+
+from tools.almacenamiento import AlmacenamientoJSON
+
+
+def _evento(i, fecha, usuario="ana"):
+    return {
+        "usuario": usuario, "accion": "actualizar_stock", "producto_id": i,
+        "campo": "stock", "valor_anterior": i, "valor_nuevo": i + 1, "fecha": fecha,
+    }
+
+
+def _ids(eventos):
+    return [e["producto_id"] for e in eventos]
+
+
+def _lineas_segmento(tmp_path, mes):
+    with gzip.open(tmp_path / f"historial.{mes}.jsonl.gz", "rb") as f:
+        return [json.loads(linea) for linea in f]
+
+
+def test_rotacion_cierra_meses_anteriores(tmp_path):
+    ruta = str(tmp_path / "historial.jsonl")
+    motor = AlmacenamientoJSON()
+
+    motor.anexar_eventos(ruta, [_evento(1, "2026-08-03 10:00:00"), _evento(2, "2026-08-20 10:00:00")])
+    motor.anexar_eventos(ruta, [_evento(3, "2026-09-01 09:00:00", usuario="luis")])
+    motor.anexar_eventos(ruta, [_evento(4, "2026-10-05 12:00:00")])
+
+    assert _ids(_lineas_segmento(tmp_path, "2026-08")) == [1, 2]
+    assert _ids(_lineas_segmento(tmp_path, "2026-09")) == [3]
+    with open(ruta, encoding="utf-8") as f:
+        assert [json.loads(linea)["producto_id"] for linea in f] == [4]
+
+    with open(tmp_path / "historial.segmentos.json", encoding="utf-8") as f:
+        manifiesto = json.load(f)
+    resumen = manifiesto["historial.2026-09.jsonl.gz"]
+    assert resumen["tamano"] == os.path.getsize(tmp_path / "historial.2026-09.jsonl.gz")
+    assert resumen["desde"] == "2026-09-01 09:00:00"
+    assert resumen["valores"]["usuario"] == ["luis"]
+
+    # Las consultas recorren segmentos y log activo
+    assert _ids(motor.consultar_eventos(ruta)) == [1, 2, 3, 4]
+    assert _ids(motor.consultar_eventos(ruta, desde="2026-08-10", hasta="2026-10-01")) == [2, 3]
+    assert _ids(motor.consultar_eventos(ruta, ultimos=3)) == [2, 3, 4]
+    assert _ids(motor.consultar_eventos(ruta, usuario="luis")) == [3]
+    assert _ids(motor.cola_eventos(ruta, 3)) == [2, 3, 4]
+    assert _ids(motor.cola_eventos(ruta, 5, usuario="ana")) == [1, 2, 4]
+    assert _ids(motor.iterar_eventos(ruta)) == [1, 2, 3, 4]
+    assert sorted(motor.valores_historial(ruta, "usuario")) == ["ana", "luis"]
+
+
+def test_rotacion_interrumpida_no_duplica_eventos(tmp_path):
+    ruta = str(tmp_path / "historial.jsonl")
+    motor = AlmacenamientoJSON()
+    motor.anexar_eventos(ruta, [_evento(1, "2026-08-03 10:00:00"), _evento(2, "2026-09-01 10:00:00")])
+
+    # El segmento de agosto se escribió, pero el log activo no llegó a recortarse
+    with open(ruta, "rb") as f:
+        agosto = f.readlines()[:1]
+    with gzip.open(tmp_path / "historial.2026-08.jsonl.gz", "wb") as f:
+        f.writelines(agosto)
+
+    assert _ids(motor.consultar_eventos(ruta)) == [1, 2]
+    assert _ids(motor.cola_eventos(ruta, 5)) == [1, 2]
+
+    motor.anexar_eventos(ruta, [_evento(3, "2026-10-01 10:00:00")])
+    assert _ids(_lineas_segmento(tmp_path, "2026-08")) == [1]
+    assert _ids(motor.consultar_eventos(ruta)) == [1, 2, 3]
+
+
+def test_rotacion_completa_un_segmento_ya_cerrado(tmp_path):
+    ruta = str(tmp_path / "historial.jsonl")
+    motor = AlmacenamientoJSON()
+    motor.anexar_eventos(ruta, [_evento(1, "2026-08-03 10:00:00")])
+    motor.anexar_eventos(ruta, [_evento(2, "2026-09-01 10:00:00")])
+
+    # El log activo se vacía y luego recibe un evento con fecha de agosto
+    open(ruta, "wb").close()
+    motor.anexar_eventos(ruta, [_evento(3, "2026-08-30 10:00:00")])
+    motor.anexar_eventos(ruta, [_evento(4, "2026-09-02 10:00:00")])
+
+    assert _ids(_lineas_segmento(tmp_path, "2026-08")) == [1, 3]
+    assert _ids(motor.consultar_eventos(ruta)) == [1, 3, 4]
@@ -0,0 +1,1134 @@
+"""
+Motores de almacenamiento para el inventario y el historial.
+
+- "json"   (por defecto): productos.json + historial.jsonl
+- "sqlite": productos.db + historial.db (modo WAL, una fila por producto/evento)
+
+El motor se elige con la variable de entorno INVENTARIO_BACKEND. Las rutas
+que reciben los métodos son siempre las de los archivos JSON; el motor
+SQLite las traduce a su base de datos hermana (mismo nombre, extensión .db).
+
+Migración de JSON a SQLite:
+
+    python -m tools.almacenamiento migrar
+"""
+import argparse
+import atexit
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import orjson  # opcional: codificador/decodificador JSON más rápido
+except ImportError:
+    orjson = None
+
+from tools.indice_historial import (
+    IndiceTemporal, SegmentoCerrado, CAMPOS_INDEXADOS,
+    coincide, dividir_por_mes, lineas_al_reves, mes, puede_contener, resumen_tramo,
+)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAIZ_PROYECTO = os.path.abspath(os.path.join(BASE_DIR, ".."))
+
+CAMPOS_PRODUCTO = ["id", "nombre", "precio", "stock", "categoria"]
+
+# Espera máxima (segundos) para obtener el bloqueo de escritura
+BLOQUEO_ESPERA = float(os.environ.get("INVENTARIO_BLOQUEO_ESPERA", "10"))
+
+# Con INVENTARIO_JSON_COMPACTO=1 el inventario se guarda sin sangría:
+# el archivo ocupa aproximadamente la mitad y se escribe antes.
+JSON_COMPACTO = os.environ.get("INVENTARIO_JSON_COMPACTO", "0") == "1"
+
+# El índice del historial (historial.jsonl.idx, un diario al que se
+# añade lo nuevo) se guarda cada tantos eventos indexados y al cerrar
+# el proceso
+INDICE_PERSISTIR_CADA = 1000
+
+# Segmentos mensuales cerrados del historial que se mantienen
+# descomprimidos en memoria a la vez
+SEGMENTOS_EN_MEMORIA = 6
+
+
+class ConflictoVersion(Exception):
+    """Otro proceso guardó el inventario después de que lo cargáramos."""
+
+
+# ==========================================================
+#   BLOQUEO ENTRE PROCESOS
+# ==========================================================
+
+def _intentar_bloqueo(f) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _liberar_bloqueo(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def bloqueo_archivo(ruta: str, espera: Optional[float] = None):
+    """
+    Bloqueo consultivo exclusivo sobre `<ruta>.lock`, compartido entre
+    procesos. Si no se obtiene en `espera` segundos lanza TimeoutError.
+    """
+    espera = BLOQUEO_ESPERA if espera is None else espera
+    limite = time.monotonic() + espera
+    pausa = 0.005
+
+    f = open(ruta + ".lock", "a+b")
+    try:
+        while not _intentar_bloqueo(f):
+            if time.monotonic() >= limite:
+                raise TimeoutError(
+                    f"No se pudo bloquear '{ruta}' en {espera:g} s: "
+                    f"otro proceso lo está escribiendo."
+                )
+            time.sleep(pausa)
+            pausa = min(pausa * 2, 0.1)
+
+        try:
+            yield
+        finally:
+            _liberar_bloqueo(f)
+    finally:
+        f.close()
+
+
+# ==========================================================
+#   ESCRITURA ATÓMICA Y CODIFICACIÓN JSON
+# ==========================================================
+
+def codificar_json(data: Any, compacto: Optional[bool] = None) -> bytes:
+    """
+    Serializa a UTF-8 con orjson si está instalado y, si no, con json.
+    `compacto` (por defecto JSON_COMPACTO) elimina sangría y espacios.
+    """
+    compacto = JSON_COMPACTO if compacto is None else compacto
+
+    if orjson is not None:
+        opciones = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if not compacto:
+            opciones |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=opciones)
+
+    if compacto:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def decodificar_json(contenido: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(contenido)
+    return json.loads(contenido)
+
+
+def _fsync_directorio(directorio: str) -> None:
+    # Hace duradero el renombrado; no disponible en Windows
+    try:
+        fd = os.open(directorio, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Máscara de permisos del proceso (mkstemp crea los temporales con 0600)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _copiar_permisos(tmp: str, ruta: str, modo_de: Optional[str]) -> None:
+    # Permisos del archivo que se reemplaza; si es nuevo, los de `modo_de`
+    # (p. ej. el log del que sale) o los de un archivo creado con open()
+    for origen in (ruta, modo_de):
+        if origen:
+            try:
+                shutil.copymode(origen, tmp)
+                return
+            except OSError:
+                pass
+    try:
+        os.chmod(tmp, 0o666 & ~_UMASK)
+    except OSError:
+        pass
+
+
+@contextmanager
+def escritura_atomica(ruta: str, reemplazar: bool = True, modo_de: Optional[str] = None):
+    """
+    Abre un temporal (binario) junto a `ruta`; al salir sin errores lo
+    sincroniza con el disco y lo renombra sobre `ruta` de forma atómica.
+    Un lector ve siempre el archivo anterior completo o el nuevo completo.
+
+    Con reemplazar=False no se pisa un archivo existente: se lanza
+    FileExistsError si otro proceso lo creó mientras tanto.
+
+    El archivo conserva los permisos del que reemplaza; uno nuevo toma
+    los de `modo_de` si se indica, o los que da la umask.
+    """
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    fd, tmp = tempfile.mkstemp(
+        prefix="." + os.path.basename(ruta) + ".", suffix=".tmp", dir=directorio
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+        _copiar_permisos(tmp, ruta, modo_de)
+
+        if not reemplazar:
+            try:
+                os.link(tmp, ruta)
+            except FileExistsError:
+                raise
+            except OSError:
+                # Sistemas de archivos sin enlaces duros
+                if os.path.exists(ruta):
+                    raise FileExistsError(ruta)
+                os.replace(tmp, ruta)
+        else:
+            for intento in range(5):
+                try:
+                    os.replace(tmp, ruta)
+                    break
+                except PermissionError:
+                    # Windows no deja reemplazar un archivo abierto por un lector
+                    if intento == 4:
+                        raise
+                    time.sleep(0.05 * (intento + 1))
+
+        _fsync_directorio(directorio)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# ==========================================================
+#   MOTOR JSON (POR DEFECTO)
+# ==========================================================
+
+class AlmacenamientoJSON:
+    nombre = "json"
+
+    def __init__(self):
+        # Índices de cada log de historial (ruta absoluta → índice)
+        self._indices: Dict[str, IndiceTemporal] = {}
+        self._indices_lock = threading.Lock()
+        # Segmentos cerrados conocidos, del menos al más recientemente usado
+        self._segmentos_cargados: "OrderedDict[str, SegmentoCerrado]" = OrderedDict()
+        atexit.register(self.persistir_indices)
+
+    # ---------------- inventario ----------------
+
+    def sello(self, ruta: str):
+        st = os.stat(ruta)
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def cargar(self, ruta: str) -> Dict[str, Any]:
+        with open(ruta, "rb") as f:
+            return decodificar_json(f.read())
+
+    def guardar(self, ruta: str, data: Dict[str, Any],
+                modificados: Optional[List[Dict[str, Any]]] = None,
+                sello_esperado=None):
+        """
+        Reescribe el archivo completo bajo el bloqueo de escritura,
+        mediante un temporal que se renombra atómicamente.
+        Si `sello_esperado` no coincide con el archivo en disco, otro
+        proceso escribió entretanto y se lanza ConflictoVersion.
+        Devuelve el sello del archivo recién escrito.
+        """
+        with bloqueo_archivo(ruta):
+            if sello_esperado is not None:
+                try:
+                    actual = self.sello(ruta)
+                except FileNotFoundError:
+                    actual = None
+                if actual != sello_esperado:
+                    raise ConflictoVersion(f"'{ruta}' cambió desde la última lectura.")
+
+            data["version"] = int(data.get("version", 0)) + 1
+
+            contenido = codificar_json(data)
+            with escritura_atomica(ruta) as f:
+                f.write(contenido)
+
+            return self.sello(ruta)
+
+    # ---------------- historial ----------------
+
+    def migrar_historial_antiguo(self, ruta: str) -> bool:
+        """
+        Migración única del historial.json antiguo ({"historial": [...]})
+        al log .jsonl indicado. El archivo antiguo se deja intacto.
+        """
+        antiguo = os.path.splitext(ruta)[0] + ".json"
+        if os.path.exists(ruta) or not os.path.exists(antiguo):
+            return False
+
+        try:
+            with open(antiguo, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        eventos = data.get("historial", []) if isinstance(data, dict) else data
+        if not isinstance(eventos, list):
+            return False
+
+        # Publicar sin pisar un log que otro proceso haya creado mientras tanto
+        try:
+            with escritura_atomica(ruta, reemplazar=False, modo_de=antiguo) as f:
+                for evento in eventos:
+                    f.write((json.dumps(evento, ensure_ascii=False) + "\n").encode("utf-8"))
+        except FileExistsError:
+            return False
+
+        return True
+
+    # ---------------- segmentos mensuales ----------------
+    # historial.jsonl es el segmento activo (el único que se escribe). Al
+    # llegar un evento de un mes nuevo, los meses anteriores se cierran en
+    # historial.AAAA-MM.jsonl.gz y se resumen en historial.segmentos.json
+    # (fecha mínima y valores de los campos indexados) para que las
+    # consultas descarten segmentos sin descomprimirlos.
+
+    @staticmethod
+    def _ruta_segmento(ruta: str, mes_segmento: str) -> str:
+        base, ext = os.path.splitext(ruta)
+        return f"{base}.{mes_segmento}{ext}.gz"
+
+    @staticmethod
+    def _ruta_manifiesto(ruta: str) -> str:
+        return os.path.splitext(ruta)[0] + ".segmentos.json"
+
+    def _manifiesto(self, ruta: str) -> Dict[str, Any]:
+        try:
+            with open(self._ruta_manifiesto(ruta), "rb") as f:
+                manifiesto = decodificar_json(f.read())
+        except (OSError, ValueError):
+            return {}
+        return manifiesto if isinstance(manifiesto, dict) else {}
+
+    def _resumen(self, manifiesto: Dict[str, Any], segmento: SegmentoCerrado) -> Optional[Dict[str, Any]]:
+        resumen = manifiesto.get(os.path.basename(segmento.ruta))
+        if isinstance(resumen, dict) and resumen.get("tamano") == segmento.identidad[3]:
+            return resumen
+        return None
+
+    def _segmentos(self, ruta: str) -> List[SegmentoCerrado]:
+        """Segmentos cerrados del log, del más antiguo al más reciente."""
+        directorio, nombre = os.path.split(ruta)
+        base, ext = os.path.splitext(nombre)
+        patron = re.compile(re.escape(base) + r"\.(\d{4}-\d{2})" + re.escape(ext) + r"\.gz$")
+
+        try:
+            nombres = sorted(os.listdir(directorio))
+        except OSError:
+            return []
+
+        segmentos = []
+        for n in nombres:
+            m = patron.match(n)
+            if m is None:
+                continue
+            ruta_segmento = os.path.join(directorio, n)
+            try:
+                st = os.stat(ruta_segmento)
+            except OSError:
+                continue
+            identidad = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+            with self._indices_lock:
+                segmento = self._segmentos_cargados.get(ruta_segmento)
+                if segmento is None or segmento.identidad != identidad:
+                    segmento = SegmentoCerrado(ruta_segmento, m.group(1), identidad)
+                    self._segmentos_cargados[ruta_segmento] = segmento
+            segmentos.append(segmento)
+        return segmentos
+
+    def _segmentos_cerrados(self, ruta: str, mes_activo: Optional[str]) -> List[SegmentoCerrado]:
+        """
+        Segmentos cuyos eventos ya no están en el log activo, del más
+        antiguo al más reciente. Los de un mes no anterior al primero del
+        log activo son de una rotación interrumpida: sus eventos siguen en
+        el log y se ignoran hasta que la siguiente rotación los reescriba.
+        """
+        return [s for s in self._segmentos(ruta) if mes_activo is None or s.mes < mes_activo]
+
+    def _usar_segmento(self, segmento: SegmentoCerrado) -> None:
+        """Marca el segmento como recién usado y descarga los más antiguos."""
+        with self._indices_lock:
+            self._segmentos_cargados.move_to_end(segmento.ruta)
+            cargados = [s for s in self._segmentos_cargados.values() if s.cargado]
+        for viejo in cargados[:max(0, len(cargados) - SEGMENTOS_EN_MEMORIA)]:
+            viejo.descargar()
+
+    @staticmethod
+    def _mes_primer_evento(f) -> Optional[str]:
+        """Mes del primer evento legible del log abierto (None si no hay)."""
+        f.seek(0)
+        for linea in f:
+            try:
+                evento = json.loads(linea)
+            except ValueError:
+                continue
+            if isinstance(evento, dict) and evento.get("fecha"):
+                return mes(str(evento["fecha"]))
+        return None
+
+    def _rotar(self, ruta: str, mes_lote: str) -> None:
+        """
+        Cierra en segmentos comprimidos los meses del log activo anteriores
+        a `mes_lote`; el log activo se queda con el resto. Se llama con el
+        bloqueo del log tomado.
+
+        Si el proceso cae a medias, los segmentos ya escritos se ignoran al
+        leer (ver _segmentos_cerrados) y se sustituyen en la siguiente
+        rotación. Un segmento del mismo mes que no viene de una rotación
+        interrumpida (p. ej. el log se vació y luego recibió eventos con
+        fecha de ese mes) se completa con el tramo, no se pisa.
+        """
+        with open(ruta, "rb") as f:
+            tramos = dividir_por_mes(f)
+
+        manifiesto = self._manifiesto(ruta)
+        quedan: List[bytes] = []
+        mes_activo = next((m for m, _ in tramos if m), None)
+
+        for mes_tramo, lineas in tramos:
+            if not mes_tramo or mes_tramo >= mes_lote:
+                quedan.extend(lineas)
+                continue
+
+            ruta_segmento = self._ruta_segmento(ruta, mes_tramo)
+            lineas = self._lineas_cerradas(ruta_segmento, mes_tramo, mes_activo, lineas) + lineas
+            with escritura_atomica(ruta_segmento, modo_de=ruta) as f:
+                with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+                    gz.writelines(lineas)
+            manifiesto[os.path.basename(ruta_segmento)] = {
+                **resumen_tramo(lineas),
+                "tamano": os.path.getsize(ruta_segmento),
+            }
+
+        with escritura_atomica(self._ruta_manifiesto(ruta), modo_de=ruta) as f:
+            f.write(codificar_json(manifiesto))
+
+        with escritura_atomica(ruta) as f:
+            f.writelines(quedan)
+
+    @staticmethod
+    def _lineas_cerradas(ruta_segmento: str, mes_segmento: str,
+                         mes_activo: str, lineas: List[bytes]) -> List[bytes]:
+        # Líneas de un segmento ya escrito que hay que conservar al volver a
+        # cerrar su mes. Si repite el principio del tramo es de una rotación
+        # interrumpida (sus eventos siguen en el log activo) y se sustituye.
+        try:
+            with gzip.open(ruta_segmento, "rb") as f:
+                previas = f.readlines()
+        except FileNotFoundError:
+            return []
+        if mes_segmento >= mes_activo and previas == lineas[:len(previas)]:
+            return []
+        return previas
+
+    # ---------------- lectura del historial ----------------
+
+    def iterar_eventos(self, ruta: str) -> Iterator[Dict[str, Any]]:
+        """
+        Recorre el historial evento a evento (segmentos cerrados y log
+        activo). Las líneas corruptas (p. ej. una escritura interrumpida)
+        se ignoran.
+        """
+        self.migrar_historial_antiguo(ruta)
+        ruta = os.path.abspath(ruta)
+
+        try:
+            activo = open(ruta, "rb")
+        except FileNotFoundError:
+            activo = None
+
+        try:
+            mes_activo = self._mes_primer_evento(activo) if activo else None
+            for segmento in self._segmentos_cerrados(ruta, mes_activo):
+                yield from self._decodificar_lineas(segmento.iterar())
+
+            if activo is not None:
+                activo.seek(0)
+                yield from self._decodificar_lineas(activo)
+        finally:
+            if activo is not None:
+                activo.close()
+
+    @staticmethod
+    def _decodificar_lineas(lineas: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+        for linea in lineas:
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                yield json.loads(linea)
+            except ValueError:
+                continue
+
+    def sello_historial(self, ruta: str):
+        """
+        Versión del historial: cambia con cada escritura del log activo
+        (también al rotar segmentos, que lo reemplaza).
+        """
+        self.migrar_historial_antiguo(ruta)
+        try:
+            st = os.stat(ruta)
+        except FileNotFoundError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _indice_historial(self, ruta: str) -> IndiceTemporal:
+        """
+        Índice del log, restaurado de `<log>.idx` la primera vez que se
+        pide en el proceso.
+        """
+        with self._indices_lock:
+            indice = self._indices.get(ruta)
+            if indice is None:
+                try:
+                    with open(ruta + ".idx", "rb") as f:
+                        indice = IndiceTemporal.desde_diario(f, decodificar_json)
+                except OSError:
+                    indice = IndiceTemporal(persistente=True)
+                self._indices[ruta] = indice
+            return indice
+
+    @staticmethod
+    def _final_diario(ruta_idx: str):
+        """
+        (diario, eventos) según la última línea del diario en disco, o
+        None si no existe o su final no se puede leer.
+        """
+        try:
+            with open(ruta_idx, "rb") as f:
+                linea = next(lineas_al_reves(f), None)
+            ultima = decodificar_json(linea) if linea else None
+            if "desde" in ultima:
+                return ultima["diario"], int(ultima["desde"]) + len(ultima["fechas"])
+            return ultima["diario"], 0
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            return None
+
+    def _persistir_indice(self, ruta: str, indice: IndiceTemporal) -> None:
+        # El diario .idx se reescribe entero solo tras reconstruir el
+        # índice; si no, se le añade un lote con lo indexado desde el
+        # último guardado. Otros procesos añaden al mismo diario: se hace
+        # bajo su bloqueo y el lote debe continuar el último del archivo.
+        ruta_idx = ruta + ".idx"
+        try:
+            with bloqueo_archivo(ruta_idx):
+                completo, lineas, marca = indice.pendiente_de_guardar()
+                if not lineas:
+                    return
+
+                if not completo:
+                    final = self._final_diario(ruta_idx)
+                    if final is None or final[0] != indice.diario or final[1] < indice.guardados:
+                        # Diario ausente, reescrito o de otro índice
+                        indice.rehacer_diario()
+                        completo, lineas, marca = indice.pendiente_de_guardar()
+                    elif final[1] > indice.guardados:
+                        # Otro proceso ya guardó parte de lo pendiente
+                        completo, lineas, marca = indice.pendiente_de_guardar(desde=final[1])
+
+                contenido = b"".join(codificar_json(linea, compacto=True) + b"\n" for linea in lineas)
+                if completo:
+                    with escritura_atomica(ruta_idx, modo_de=ruta) as f:
+                        f.write(contenido)
+                else:
+                    with open(ruta_idx, "ab") as f:
+                        f.write(contenido)
+        except (OSError, TimeoutError):
+            return  # el índice se reconstruye a partir del log si falta
+        indice.marcar_guardado(marca)
+
+    def persistir_indices(self) -> None:
+        """Guarda en disco los índices del historial con eventos nuevos."""
+        with self._indices_lock:
+            pendientes = [(r, i) for r, i in self._indices.items() if i.sin_persistir]
+        for ruta, indice in pendientes:
+            self._persistir_indice(ruta, indice)
+
+    def consultar_eventos(self, ruta: str, desde: Optional[str] = None,
+                          hasta: Optional[str] = None,
+                          ultimos: Optional[int] = None,
+                          **filtros) -> List[Dict[str, Any]]:
+        """
+        Eventos con desde <= fecha < hasta en orden cronológico (los N
+        últimos con `ultimos`), filtrados por usuario/accion/producto_id/
+        campo. Se resuelve con el índice del log, sin recorrerlo entero.
+        """
+        self.migrar_historial_antiguo(ruta)
+
+        ruta = os.path.abspath(ruta)
+        indice = self._indice_historial(ruta)
+        partes = [indice.consultar(ruta, desde, hasta, ultimos, **filtros)]
+
+        if indice.sin_persistir >= INDICE_PERSISTIR_CADA:
+            self._persistir_indice(ruta, indice)
+
+        # Segmentos cerrados, del más reciente al más antiguo: solo se
+        # descomprimen los que pueden tener eventos del resultado
+        primera = indice.primera_fecha()
+        mes_activo = mes(primera) if primera else None
+        manifiesto = None
+
+        for segmento in reversed(self._segmentos_cerrados(ruta, mes_activo)):
+            if desde is not None and segmento.mes < mes(desde):
+                break  # este y los anteriores terminan antes del rango
+            if ultimos is not None:
+                fechas = sorted(str(e.get("fecha") or "") for parte in partes for e in parte)
+                if len(fechas) >= ultimos and (ultimos == 0 or mes(fechas[-ultimos]) > segmento.mes):
+                    break  # ya hay N eventos posteriores a todo lo que queda
+
+            if manifiesto is None:
+                manifiesto = self._manifiesto(ruta)
+            if not puede_contener(self._resumen(manifiesto, segmento), hasta, filtros):
+                continue
+
+            partes.append(segmento.consultar(desde, hasta, ultimos, **filtros))
+            self._usar_segmento(segmento)
+
+        if len(partes) == 1:
+            return partes[0]
+
+        # Orden cronológico estable: a igual fecha, primero lo más antiguo
+        eventos = [e for parte in reversed(partes) for e in parte]
+        eventos.sort(key=lambda e: str(e.get("fecha") or ""))
+        if ultimos is not None:
+            eventos = eventos[max(0, len(eventos) - ultimos):]
+        return eventos
+
+    def cola_eventos(self, ruta: str, n: int, **filtros) -> List[Dict[str, Any]]:
+        """
+        Los N últimos eventos escritos que cumplen los filtros, en orden
+        cronológico. Lee el log hacia atrás desde el final, sin índice: el
+        coste depende de cuánto haya que retroceder, no del tamaño del log.
+        Si el log activo no basta se sigue por los segmentos cerrados.
+        """
+        desconocidos = set(filtros) - set(CAMPOS_INDEXADOS)
+        if desconocidos:
+            raise TypeError(f"Filtros no indexados: {', '.join(sorted(desconocidos))}")
+
+        self.migrar_historial_antiguo(ruta)
+        ruta = os.path.abspath(ruta)
+
+        encontrados: List[Dict[str, Any]] = []
+        if n <= 0:
+            return encontrados
+
+        def recoger(lineas: Iterable[bytes]) -> bool:
+            for evento in self._decodificar_lineas(lineas):
+                if isinstance(evento, dict) and coincide(evento, filtros):
+                    encontrados.append(evento)
+                    if len(encontrados) >= n:
+                        return True
+            return False
+
+        mes_activo = None
+        try:
+            with open(ruta, "rb") as f:
+                mes_activo = self._mes_primer_evento(f)
+                completo = recoger(lineas_al_reves(f))
+        except FileNotFoundError:
+            completo = False
+
+        if not completo:
+            manifiesto = self._manifiesto(ruta)
+            for segmento in reversed(self._segmentos_cerrados(ruta, mes_activo)):
+                if not puede_contener(self._resumen(manifiesto, segmento), None, filtros):
+                    continue
+                completo = recoger(segmento.lineas_al_reves())
+                self._usar_segmento(segmento)
+                if completo:
+                    break
+
+        encontrados.reverse()
+        return encontrados
+
+    def valores_historial(self, ruta: str, campo: str) -> List[str]:
+        """Valores distintos (como texto) de un campo indexado del historial."""
+        self.migrar_historial_antiguo(ruta)
+        ruta = os.path.abspath(ruta)
+
+        indice = self._indice_historial(ruta)
+        valores = set(indice.valores(ruta, campo))
+
+        primera = indice.primera_fecha()
+        mes_activo = mes(primera) if primera else None
+        manifiesto = self._manifiesto(ruta)
+
+        for segmento in self._segmentos_cerrados(ruta, mes_activo):
+            resumen = self._resumen(manifiesto, segmento)
+            if resumen is not None and campo in resumen.get("valores", {}):
+                valores.update(resumen["valores"][campo])
+            else:
+                valores.update(segmento.valores(campo))
+                self._usar_segmento(segmento)
+        return list(valores)
+
+    def anexar_eventos(self, ruta: str, eventos: List[Dict[str, Any]],
+                       fsync: bool = False) -> None:
+        """
+        Añade los eventos al final del log en una sola escritura.
+        Si la última línea quedó a medias (caída durante una escritura),
+        se cierra antes para no corromper los eventos nuevos.
+        """
+        self.migrar_historial_antiguo(ruta)
+
+        bloque = "".join(
+            json.dumps(e, ensure_ascii=False) + "\n" for e in eventos
+        ).encode("utf-8")
+        mes_lote = next((mes(str(e["fecha"])) for e in eventos if e.get("fecha")), None)
+
+        # El bloqueo solo coordina con la rotación de segmentos
+        with bloqueo_archivo(ruta):
+            if mes_lote is not None:
+                try:
+                    with open(ruta, "rb") as f:
+                        mes_activo = self._mes_primer_evento(f)
+                except FileNotFoundError:
+                    mes_activo = None
+                if mes_activo is not None and mes_lote > mes_activo:
+                    self._rotar(ruta, mes_lote)
+
+            with open(ruta, "ab+") as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        bloque = b"\n" + bloque
+                f.write(bloque)
+                f.flush()
+                if fsync:
+                    os.fsync(f.fileno())
+
+    def reescribir_historial(self, ruta: str, eventos: Iterable[Dict[str, Any]]) -> None:
+        """
+        Sustituye el historial completo por `eventos` en el log activo; los
+        segmentos cerrados se eliminan (la siguiente rotación los rehace).
+        """
+        ruta = os.path.abspath(ruta)
+        with bloqueo_archivo(ruta):
+            with escritura_atomica(ruta) as f:
+                for evento in eventos:
+                    f.write((json.dumps(evento, ensure_ascii=False) + "\n").encode("utf-8"))
+
+            for segmento in self._segmentos(ruta):
+                os.remove(segmento.ruta)
+            if os.path.exists(self._ruta_manifiesto(ruta)):
+                os.remove(self._ruta_manifiesto(ruta))
+            with self._indices_lock:
+                self._segmentos_cargados.clear()
+
+
+# ==========================================================
+#   MOTOR SQLITE
+# ==========================================================
+
+ESQUEMA_PRODUCTOS = """
+CREATE TABLE IF NOT EXISTS productos (
+    id        INTEGER PRIMARY KEY,
+    nombre    TEXT NOT NULL,
+    precio    REAL NOT NULL,
+    stock     INTEGER NOT NULL,
+    categoria TEXT NOT NULL,
+    extra     TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_productos_categoria ON productos(categoria);
+CREATE INDEX IF NOT EXISTS idx_productos_nombre ON productos(nombre);
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor TEXT
+);
+INSERT OR IGNORE INTO meta(clave, valor) VALUES ('version', '0');
+"""
+
+ESQUEMA_HISTORIAL = """
+CREATE TABLE IF NOT EXISTS historial (
+    seq            INTEGER PRIMARY KEY AUTOINCREMENT,
+    usuario        TEXT,
+    accion         TEXT,
+    producto_id    INTEGER,
+    campo          TEXT,
+    valor_anterior TEXT,
+    valor_nuevo    TEXT,
+    fecha          TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_historial_fecha ON historial(fecha);
+CREATE INDEX IF NOT EXISTS idx_historial_producto ON historial(producto_id);
+CREATE INDEX IF NOT EXISTS idx_historial_usuario ON historial(usuario);
+CREATE INDEX IF NOT EXISTS idx_historial_accion ON historial(accion);
+CREATE INDEX IF NOT EXISTS idx_historial_campo ON historial(campo);
+"""
+
+
+def ruta_sqlite(ruta: str) -> str:
+    """productos.json → productos.db, historial.jsonl → historial.db"""
+    return os.path.splitext(os.path.abspath(ruta))[0] + ".db"
+
+
+class AlmacenamientoSQLite:
+    nombre = "sqlite"
+
+    def __init__(self):
+        # sqlite3 no permite compartir conexiones entre hilos
+        self._local = threading.local()
+
+    def _conectar(self, ruta_db: str, esquema: str, crear: bool = False) -> sqlite3.Connection:
+        conexiones = getattr(self._local, "conexiones", None)
+        if conexiones is None:
+            conexiones = self._local.conexiones = {}
+
+        con = conexiones.get(ruta_db)
+        if con is not None:
+            return con
+
+        if not crear and not os.path.exists(ruta_db):
+            raise FileNotFoundError(
+                f"La base de datos '{ruta_db}' no existe. "
+                f"Ejecuta: python -m tools.almacenamiento migrar"
+            )
+
+        con = sqlite3.connect(ruta_db, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.executescript(esquema)
+        conexiones[ruta_db] = con
+        return con
+
+    # ---------------- inventario ----------------
+
+    def _con_productos(self, ruta: str, crear: bool = False) -> sqlite3.Connection:
+        return self._conectar(ruta_sqlite(ruta), ESQUEMA_PRODUCTOS, crear)
+
+    def sello(self, ruta: str):
+        con = self._con_productos(ruta)
+        fila = con.execute("SELECT valor FROM meta WHERE clave = 'version'").fetchone()
+        return ("sqlite", int(fila[0]))
+
+    def cargar(self, ruta: str) -> Dict[str, Any]:
+        con = self._con_productos(ruta)
+        data = {}
+        for clave, valor in con.execute("SELECT clave, valor FROM meta WHERE clave LIKE 'data.%'"):
+            data[clave[len("data."):]] = json.loads(valor)
+        data["version"] = self.sello(ruta)[1]
+
+        productos = []
+        for pid, nombre, precio, stock, categoria, extra in con.execute(
+            "SELECT id, nombre, precio, stock, categoria, extra FROM productos ORDER BY id"
+        ):
+            producto = {"id": pid, "nombre": nombre, "precio": precio,
+                        "stock": stock, "categoria": categoria}
+            if extra:
+                producto.update(json.loads(extra))
+            productos.append(producto)
+
+        data["productos"] = productos
+        return data
+
+    @staticmethod
+    def _fila_producto(p: Dict[str, Any]):
+        extra = {k: v for k, v in p.items() if k not in CAMPOS_PRODUCTO}
+        return (
+            int(p["id"]), p.get("nombre"), float(p.get("precio")),
+            int(p.get("stock")), p.get("categoria"),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    def guardar(self, ruta: str, data: Dict[str, Any],
+                modificados: Optional[List[Dict[str, Any]]] = None,
+                sello_esperado=None, crear: bool = False):
+        """
+        Con `modificados` solo se escriben esas filas (UPDATE/INSERT
+        por producto). Sin él se sincroniza la tabla completa.
+        La versión se comprueba e incrementa dentro de la transacción;
+        si no coincide con `sello_esperado` se lanza ConflictoVersion.
+        """
+        con = self._con_productos(ruta, crear)
+        productos = data.get("productos", [])
+
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            version = int(con.execute(
+                "SELECT valor FROM meta WHERE clave = 'version'"
+            ).fetchone()[0])
+            if sello_esperado is not None and ("sqlite", version) != sello_esperado:
+                raise ConflictoVersion(f"'{ruta_sqlite(ruta)}' cambió desde la última lectura.")
+
+            filas = productos if modificados is None else modificados
+            con.executemany(
+                "INSERT INTO productos(id, nombre, precio, stock, categoria, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET nombre = excluded.nombre, "
+                "precio = excluded.precio, stock = excluded.stock, "
+                "categoria = excluded.categoria, extra = excluded.extra",
+                [self._fila_producto(p) for p in filas],
+            )
+
+            if modificados is None:
+                vigentes = {int(p["id"]) for p in productos}
+                sobrantes = [
+                    (pid,) for (pid,) in con.execute("SELECT id FROM productos")
+                    if pid not in vigentes
+                ]
+                con.executemany("DELETE FROM productos WHERE id = ?", sobrantes)
+
+                for clave, valor in data.items():
+                    if clave not in ("productos", "version"):
+                        con.execute(
+                            "INSERT OR REPLACE INTO meta(clave, valor) VALUES (?, ?)",
+                            ("data." + clave, json.dumps(valor, ensure_ascii=False)),
+                        )
+
+            con.execute(
+                "UPDATE meta SET valor = ? WHERE clave = 'version'", (str(version + 1),)
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+        data["version"] = version + 1
+        return ("sqlite", version + 1)
+
+    # ---------------- historial ----------------
+
+    def _con_historial(self, ruta: str) -> sqlite3.Connection:
+        return self._conectar(ruta_sqlite(ruta), ESQUEMA_HISTORIAL, crear=True)
+
+    def iterar_eventos(self, ruta: str) -> Iterator[Dict[str, Any]]:
+        con = self._con_historial(ruta)
+        cursor = con.execute(
+            "SELECT usuario, accion, producto_id, campo, valor_anterior, valor_nuevo, fecha "
+            "FROM historial ORDER BY seq"
+        )
+        for fila in cursor:
+            yield self._evento(fila)
+
+    def consultar_eventos(self, ruta: str, desde: Optional[str] = None,
+                          hasta: Optional[str] = None,
+                          ultimos: Optional[int] = None,
+                          **filtros) -> List[Dict[str, Any]]:
+        desconocidos = set(filtros) - set(CAMPOS_INDEXADOS)
+        if desconocidos:
+            raise TypeError(f"Filtros no indexados: {', '.join(sorted(desconocidos))}")
+
+        condiciones, parametros = [], []
+        for campo, valor in filtros.items():
+            if valor is not None:
+                condiciones.append(f"{campo} = ?")
+                parametros.append(valor)
+        if desde is not None:
+            condiciones.append("fecha >= ?")
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append("fecha < ?")
+            parametros.append(hasta)
+
+        sql = ("SELECT usuario, accion, producto_id, campo, valor_anterior, valor_nuevo, fecha "
+               "FROM historial")
+        if condiciones:
+            sql += " WHERE " + " AND ".join(condiciones)
+
+        con = self._con_historial(ruta)
+        if ultimos is None:
+            filas = con.execute(sql + " ORDER BY fecha, seq", parametros).fetchall()
+        else:
+            filas = con.execute(sql + " ORDER BY fecha DESC, seq DESC LIMIT ?",
+                                parametros + [ultimos]).fetchall()
+            filas.reverse()
+        return [self._evento(fila) for fila in filas]
+
+    def sello_historial(self, ruta: str):
+        # seq es AUTOINCREMENT: nunca se reutiliza, ni tras reescribir
+        con = self._con_historial(ruta)
+        return ("sqlite", con.execute("SELECT MAX(seq) FROM historial").fetchone()[0])
+
+    def cola_eventos(self, ruta: str, n: int, **filtros) -> List[Dict[str, Any]]:
+        # Con SQLite el índice por seq/columnas ya resuelve la consulta
+        return self.consultar_eventos(ruta, ultimos=max(n, 0), **filtros)
+
+    def valores_historial(self, ruta: str, campo: str) -> List[str]:
+        if campo not in CAMPOS_INDEXADOS:
+            raise TypeError(f"Campo no indexado: {campo}")
+        con = self._con_historial(ruta)
+        return [
+            "" if valor is None else str(valor)
+            for (valor,) in con.execute(f"SELECT DISTINCT {campo} FROM historial")
+        ]
+
+    @staticmethod
+    def _evento(fila) -> Dict[str, Any]:
+        usuario, accion, producto_id, campo, anterior, nuevo, fecha = fila
+        return {
+            "usuario": usuario,
+            "accion": accion,
+            "producto_id": producto_id,
+            "campo": campo,
+            "valor_anterior": json.loads(anterior) if anterior is not None else None,
+            "valor_nuevo": json.loads(nuevo) if nuevo is not None else None,
+            "fecha": fecha,
+        }
+
+    @staticmethod
+    def _fila_evento(e: Dict[str, Any]):
+        return (
+            e.get("usuario"), e.get("accion"), e.get("producto_id"), e.get("campo"),
+            json.dumps(e.get("valor_anterior"), ensure_ascii=False),
+            json.dumps(e.get("valor_nuevo"), ensure_ascii=False),
+            e.get("fecha"),
+        )
+
+    def anexar_eventos(self, ruta: str, eventos: List[Dict[str, Any]],
+                       fsync: bool = False) -> None:
+        con = self._con_historial(ruta)
+        if fsync:
+            con.execute("PRAGMA synchronous=FULL")
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.executemany(
+                "INSERT INTO historial(usuario, accion, producto_id, campo, "
+                "valor_anterior, valor_nuevo, fecha) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._fila_evento(e) for e in eventos],
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            if fsync:
+                con.execute("PRAGMA synchronous=NORMAL")
+
+    def reescribir_historial(self, ruta: str, eventos: Iterable[Dict[str, Any]]) -> None:
+        con = self._con_historial(ruta)
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute("DELETE FROM historial")
+            con.executemany(
+                "INSERT INTO historial(usuario, accion, producto_id, campo, "
+                "valor_anterior, valor_nuevo, fecha) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._fila_evento(e) for e in eventos),
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+
+# ==========================================================
+#   SELECCIÓN DEL MOTOR
+# ==========================================================
+
+MOTORES = {
+    "json": AlmacenamientoJSON,
+    "sqlite": AlmacenamientoSQLite,
+}
+
+_instancias: Dict[str, Any] = {}
+_instancias_lock = threading.Lock()
+
+
+def obtener_almacenamiento(nombre: Optional[str] = None):
+    """
+    Devuelve el motor indicado o, por defecto, el de INVENTARIO_BACKEND
+    (json si no está definida).
+    """
+    nombre = (nombre or os.environ.get("INVENTARIO_BACKEND") or "json").lower()
+    if nombre not in MOTORES:
+        raise ValueError(
+            f"Motor de almacenamiento desconocido: '{nombre}'. "
+            f"Opciones: {', '.join(MOTORES)}"
+        )
+
+    with _instancias_lock:
+        if nombre not in _instancias:
+            _instancias[nombre] = MOTORES[nombre]()
+        return _instancias[nombre]
+
+
+# ==========================================================
+#   MIGRACIÓN JSON → SQLITE
+# ==========================================================
+
+def migrar_a_sqlite(ruta_productos: str, ruta_historial: str) -> str:
+    origen = AlmacenamientoJSON()
+    destino = AlmacenamientoSQLite()
+
+    data = origen.cargar(ruta_productos)
+    destino.guardar(ruta_productos, data, crear=True)
+
+    n_eventos = 0
+
+    def contar(eventos):
+        nonlocal n_eventos
+        for e in eventos:
+            n_eventos += 1
+            yield e
+
+    destino.reescribir_historial(ruta_historial, contar(origen.iterar_eventos(ruta_historial)))
+
+    return (
+        f"Migración completada: {len(data.get('productos', []))} productos → "
+        f"{ruta_sqlite(ruta_productos)}, {n_eventos} eventos → {ruta_sqlite(ruta_historial)}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m tools.almacenamiento",
+        description="Utilidades del almacenamiento del inventario.",
+    )
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    migrar = sub.add_parser("migrar", help="Copia productos.json e historial a SQLite.")
+    migrar.add_argument("--productos", default=os.path.join(RAIZ_PROYECTO, "productos.json"))
+    migrar.add_argument("--historial", default=os.path.join(RAIZ_PROYECTO, "historial.jsonl"))
+
+    args = parser.parse_args(argv)
+
+    if args.comando == "migrar":
+        print(migrar_a_sqlite(args.productos, args.historial))
+
+
+if __name__ == "__main__":
+    main()
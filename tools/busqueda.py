@@ -0,0 +1,139 @@
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+
+def trigramas(texto: str) -> Set[str]:
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def subcadenas_cortas(texto: str) -> Set[str]:
+    """Subcadenas de 1 y 2 caracteres del texto."""
+    return set(texto) | {texto[i:i + 2] for i in range(len(texto) - 1)}
+
+
+class IndiceBusqueda:
+    """
+    Índice invertido para buscar subcadenas en nombre y categoría.
+
+    - Nombres: postings de trigramas → IDs. Una consulta de 3+ caracteres
+      solo revisa los productos que contienen todos sus trigramas.
+    - Consultas de 1-2 caracteres: postings de cada subcadena de 1 y 2
+      caracteres → IDs, que ya son el resultado. Duplican el coste de
+      construir el índice, así que se crean con la primera consulta corta.
+    - Categorías: hay pocas y distintas, así que se guardan como
+      categoría → IDs y se comprueba la subcadena sobre cada categoría.
+
+    Se construye una vez por versión del inventario (ver
+    tools.utils.obtener_derivado) y se actualiza con actualizar() cada vez
+    que se guardan productos modificados.
+    """
+
+    def __init__(self, productos: Iterable[Dict[str, Any]]):
+        self._lock = threading.Lock()
+        self._nombres: Dict[int, str] = {}
+        self._categorias: Dict[int, str] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._cortos: Optional[Dict[str, Set[int]]] = None
+        self._por_categoria: Dict[str, Set[int]] = {}
+
+        for p in productos:
+            self._agregar(p)
+
+    # ---------------- mantenimiento ----------------
+
+    def _agregar(self, p: Dict[str, Any]) -> None:
+        pid = int(p.get("id"))
+        nombre = str(p.get("nombre") or "").lower()
+        categoria = str(p.get("categoria") or "").lower()
+
+        self._nombres[pid] = nombre
+        self._categorias[pid] = categoria
+
+        for t in trigramas(nombre):
+            self._postings.setdefault(t, set()).add(pid)
+        if self._cortos is not None:
+            for c in subcadenas_cortas(nombre):
+                self._cortos.setdefault(c, set()).add(pid)
+        self._por_categoria.setdefault(categoria, set()).add(pid)
+
+    def _eliminar(self, pid: int) -> None:
+        nombre = self._nombres.pop(pid, None)
+        if nombre is not None:
+            for t in trigramas(nombre):
+                ids = self._postings.get(t)
+                if ids is not None:
+                    ids.discard(pid)
+                    if not ids:
+                        del self._postings[t]
+            if self._cortos is not None:
+                for c in subcadenas_cortas(nombre):
+                    ids = self._cortos.get(c)
+                    if ids is not None:
+                        ids.discard(pid)
+                        if not ids:
+                            del self._cortos[c]
+
+        categoria = self._categorias.pop(pid, None)
+        if categoria is not None:
+            ids = self._por_categoria.get(categoria)
+            if ids is not None:
+                ids.discard(pid)
+                if not ids:
+                    del self._por_categoria[categoria]
+
+    def actualizar(self, productos: Iterable[Dict[str, Any]]) -> None:
+        """Reindexa los productos insertados o modificados."""
+        with self._lock:
+            for p in productos:
+                pid = int(p.get("id"))
+                if (self._nombres.get(pid) == str(p.get("nombre") or "").lower()
+                        and self._categorias.get(pid) == str(p.get("categoria") or "").lower()):
+                    continue
+                self._eliminar(pid)
+                self._agregar(p)
+
+    def _construir_cortos(self) -> Dict[str, Set[int]]:
+        if self._cortos is None:
+            cortos: Dict[str, Set[int]] = {}
+            for pid, nombre in self._nombres.items():
+                for c in subcadenas_cortas(nombre):
+                    cortos.setdefault(c, set()).add(pid)
+            self._cortos = cortos
+        return self._cortos
+
+    # ---------------- consulta ----------------
+
+    def buscar(self, query: str) -> List[int]:
+        """
+        Devuelve, ordenados, los IDs cuyo nombre o categoría contienen
+        `query` (sin distinguir mayúsculas).
+        """
+        q = query.lower()
+
+        with self._lock:
+            encontrados: Set[int] = set()
+
+            for categoria, ids in self._por_categoria.items():
+                if q in categoria:
+                    encontrados |= ids
+
+            tris = trigramas(q)
+            if tris:
+                listas = [self._postings.get(t) for t in tris]
+                if all(listas):
+                    listas.sort(key=len)
+                    candidatos = set(listas[0])
+                    for ids in listas[1:]:
+                        candidatos &= ids
+                        if not candidatos:
+                            break
+                    encontrados.update(
+                        pid for pid in candidatos if q in self._nombres[pid]
+                    )
+            elif q:
+                # Consultas de 1-2 caracteres: no hay trigramas que usar
+                encontrados |= self._construir_cortos().get(q, set())
+            else:
+                encontrados.update(self._nombres)
+
+        return sorted(encontrados)
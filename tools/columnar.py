@@ -0,0 +1,199 @@
+"""
+Importación y exportación columnar (Parquet) del catálogo y del historial.
+
+Requiere pyarrow (opcional):  pip install pyarrow
+"""
+import atexit
+import json
+import os
+import threading
+
+import pandas as pd
+
+from tools.almacenamiento import escritura_atomica
+from tools.utils import cargar_inventario, version_inventario
+from tools.historial import iterar_historial
+from tools.importador import validar_csv, aplicar_importacion
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RAIZ_PROYECTO = os.path.abspath(os.path.join(BASE_DIR, ".."))
+
+TIPOS_INVENTARIO = {
+    "id": "int64",
+    "nombre": "string",
+    "precio": "float64",
+    "stock": "int64",
+    "categoria": "string",
+}
+
+# Metadato del Parquet con la versión del inventario de la instantánea
+CLAVE_VERSION = b"inventario.version"
+
+
+def pyarrow_disponible():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _requiere_pyarrow():
+    if not pyarrow_disponible():
+        raise ImportError(
+            "La importación/exportación Parquet necesita pyarrow: pip install pyarrow"
+        )
+
+
+def inventario_a_dataframe(productos):
+    """Lista de productos → DataFrame con los tipos del catálogo."""
+    df = pd.DataFrame(productos, columns=list(TIPOS_INVENTARIO))
+    return df.astype(TIPOS_INVENTARIO)
+
+
+def historial_a_dataframe(eventos):
+    """
+    Eventos → DataFrame tipado. Los valores anterior/nuevo pueden ser
+    números o textos, así que se guardan como JSON en columnas de texto.
+    """
+    df = pd.DataFrame(eventos, columns=[
+        "usuario", "accion", "producto_id", "campo",
+        "valor_anterior", "valor_nuevo", "fecha",
+    ])
+    for col in ("valor_anterior", "valor_nuevo"):
+        df[col] = df[col].map(lambda v: json.dumps(v, ensure_ascii=False))
+    return df.astype({
+        "usuario": "string",
+        "accion": "string",
+        "producto_id": "Int64",
+        "campo": "string",
+        "valor_anterior": "string",
+        "valor_nuevo": "string",
+    }).assign(fecha=pd.to_datetime(df["fecha"], format="%Y-%m-%d %H:%M:%S"))
+
+
+# ==========================================================
+#   EXPORTACIÓN
+# ==========================================================
+
+def exportar_inventario_parquet(file_path, destino=None):
+    _requiere_pyarrow()
+    destino = destino or os.path.splitext(os.path.abspath(file_path))[0] + ".parquet"
+
+    productos, _ = cargar_inventario(file_path)
+    inventario_a_dataframe(productos).to_parquet(destino, index=False, compression="zstd")
+
+    return f"Inventario exportado: {len(productos)} productos → {destino}"
+
+
+def exportar_historial_parquet(destino=None):
+    _requiere_pyarrow()
+    destino = destino or os.path.join(RAIZ_PROYECTO, "historial.parquet")
+
+    df = historial_a_dataframe(iterar_historial())
+    df.to_parquet(destino, index=False, compression="zstd")
+
+    return f"Historial exportado: {len(df)} eventos → {destino}"
+
+
+# ==========================================================
+#   IMPORTACIÓN
+# ==========================================================
+
+def importar_parquet(file_path_json, ruta_parquet, usuario="desconocido"):
+    """
+    Importa productos desde Parquet con las mismas reglas que el CSV
+    (validar_csv + aplicar_importacion).
+    """
+    _requiere_pyarrow()
+    df = pd.read_parquet(ruta_parquet)
+
+    errores = validar_csv(df)
+    if errores:
+        return "El archivo tiene errores:\n- " + "\n- ".join(errores)
+
+    return aplicar_importacion(file_path_json, df, usuario)
+
+
+# ==========================================================
+#   INSTANTÁNEA COLUMNAR PARA EL DASHBOARD
+# ==========================================================
+
+# Instantáneas ya escritas por este proceso y pendientes de escribir al
+# salir (ruta → (versión, DataFrame))
+_instantaneas_escritas = set()
+_instantaneas_pendientes = {}
+_instantaneas_lock = threading.Lock()
+
+
+def ruta_instantanea(file_path):
+    """Ruta de la instantánea del Dashboard (distinta de la exportación)."""
+    return os.path.splitext(os.path.abspath(file_path))[0] + ".instantanea.parquet"
+
+
+def _escribir_instantanea(ruta, version, df):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), CLAVE_VERSION: version})
+    try:
+        # Otras sesiones o procesos pueden estar leyéndola
+        with escritura_atomica(ruta) as f:
+            pq.write_table(tabla, f, compression="zstd")
+    except OSError:
+        pass  # sin permisos de escritura: se usa el DataFrame en memoria
+
+
+def guardar_instantaneas_pendientes():
+    """Escribe las instantáneas que quedaron desactualizadas (al salir)."""
+    with _instantaneas_lock:
+        pendientes = list(_instantaneas_pendientes.items())
+        _instantaneas_pendientes.clear()
+    for ruta, (version, df) in pendientes:
+        _escribir_instantanea(ruta, version, df)
+
+
+atexit.register(guardar_instantaneas_pendientes)
+
+
+def cargar_dataframe_inventario(file_path):
+    """
+    DataFrame tipado del inventario. Con pyarrow se mantiene una
+    instantánea `<inventario>.instantanea.parquet` etiquetada con la
+    versión del inventario: si está al día se lee directamente, sin
+    parsear el JSON ni construir el DataFrame desde la lista de diccionarios.
+
+    La instantánea solo sirve en un arranque en frío (en marcha, la UI ya
+    cachea el DataFrame por versión): se escribe la primera vez que este
+    proceso la necesita y, después, solo la última versión al salir.
+    """
+    if not pyarrow_disponible():
+        productos, _ = cargar_inventario(file_path)
+        return inventario_a_dataframe(productos)
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    ruta = ruta_instantanea(file_path)
+    version = repr(version_inventario(file_path)).encode("utf-8")
+
+    try:
+        tabla = pq.read_table(ruta)
+        if (tabla.schema.metadata or {}).get(CLAVE_VERSION) == version:
+            return tabla.to_pandas().astype(TIPOS_INVENTARIO)
+    except (OSError, pa.ArrowInvalid):
+        pass
+
+    productos, _ = cargar_inventario(file_path)
+    df = inventario_a_dataframe(productos)
+
+    with _instantaneas_lock:
+        primera = ruta not in _instantaneas_escritas
+        _instantaneas_escritas.add(ruta)
+        if not primera:
+            _instantaneas_pendientes[ruta] = (version, df)
+    if primera:
+        _escribir_instantanea(ruta, version, df)
+
+    return df
@@ -0,0 +1,161 @@
+import heapq
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# Umbral de stock crítico del Dashboard
+STOCK_CRITICO = 5
+
+
+def _primeros(monticulo: List[tuple], n: int, vigente: Callable[[tuple], bool]) -> List[tuple]:
+    # Las `n` primeras entradas vigentes, en orden, sin extraerlas: solo se
+    # visitan los nodos del árbol que pueden ir delante de ellas
+    resultado = []
+    frontera = [(monticulo[0], 0)] if monticulo else []
+    while frontera and len(resultado) < n:
+        entrada, i = heapq.heappop(frontera)
+        if vigente(entrada):
+            resultado.append(entrada)
+        for hijo in (2 * i + 1, 2 * i + 2):
+            if hijo < len(monticulo):
+                heapq.heappush(frontera, (monticulo[hijo], hijo))
+    return resultado
+
+
+class EstadisticasInventario:
+    """
+    Agregados del Dashboard mantenidos de forma incremental:
+
+    - stock total y número de productos
+    - por categoría: suma de stock y número de productos
+    - conjunto de productos con stock crítico (≤ STOCK_CRITICO)
+    - dos montículos (stock, id) para los N con menos / más stock
+
+    Se construye una vez por versión del inventario (ver
+    tools.utils.obtener_derivado) y actualizar() aplica solo los productos
+    insertados o modificados: cada uno cuesta O(log n), dos inserciones en
+    los montículos. La entrada anterior de un producto no se busca; queda
+    obsoleta, las consultas la saltan y los montículos se rehacen cuando
+    las obsoletas superan a las vigentes. Leer los agregados no recorre el
+    inventario.
+    """
+
+    def __init__(self, productos: Iterable[Dict[str, Any]]):
+        self._lock = threading.Lock()
+        # Copia de cada producto tal como está contado en los agregados
+        self._productos: Dict[int, Dict[str, Any]] = {}
+        self._stock_total = 0
+        self._por_categoria: Dict[str, List[int]] = {}  # categoría → [stock, productos]
+        self._criticos = set()
+        # Entradas (stock, id, generación) y (-stock, -id, generación); solo
+        # vale la de la generación actual de cada producto
+        self._generacion: Dict[int, int] = {}
+        self._siguiente = 0
+        self._menores: List[Tuple[int, int, int]] = []
+        self._mayores: List[Tuple[int, int, int]] = []
+        self._obsoletas = 0
+
+        for p in productos:
+            self._sumar(dict(p))
+        heapq.heapify(self._menores)
+        heapq.heapify(self._mayores)
+
+    # ---------------- mantenimiento ----------------
+
+    def _sumar(self, p: Dict[str, Any], ordenar: bool = False) -> None:
+        pid = int(p["id"])
+        stock = int(p["stock"])
+        categoria = p["categoria"]
+
+        self._productos[pid] = p
+        self._stock_total += stock
+
+        agregado = self._por_categoria.setdefault(categoria, [0, 0])
+        agregado[0] += stock
+        agregado[1] += 1
+
+        if stock <= STOCK_CRITICO:
+            self._criticos.add(pid)
+
+        generacion = self._siguiente
+        self._siguiente += 1
+        self._generacion[pid] = generacion
+        if ordenar:
+            heapq.heappush(self._menores, (stock, pid, generacion))
+            heapq.heappush(self._mayores, (-stock, -pid, generacion))
+        else:
+            self._menores.append((stock, pid, generacion))
+            self._mayores.append((-stock, -pid, generacion))
+
+    def _restar(self, pid: int) -> None:
+        p = self._productos.pop(pid, None)
+        if p is None:
+            return
+        stock = int(p["stock"])
+        categoria = p["categoria"]
+
+        self._stock_total -= stock
+
+        agregado = self._por_categoria[categoria]
+        agregado[0] -= stock
+        agregado[1] -= 1
+        if agregado[1] == 0:
+            del self._por_categoria[categoria]
+
+        self._criticos.discard(pid)
+
+        # Sus entradas en los montículos quedan obsoletas
+        del self._generacion[pid]
+        self._obsoletas += 1
+
+    def _compactar(self) -> None:
+        self._menores = []
+        self._mayores = []
+        for pid, p in self._productos.items():
+            stock = int(p["stock"])
+            generacion = self._generacion[pid]
+            self._menores.append((stock, pid, generacion))
+            self._mayores.append((-stock, -pid, generacion))
+        heapq.heapify(self._menores)
+        heapq.heapify(self._mayores)
+        self._obsoletas = 0
+
+    def actualizar(self, productos: Iterable[Dict[str, Any]]) -> None:
+        """Aplica los productos insertados o modificados."""
+        with self._lock:
+            for p in productos:
+                self._restar(int(p["id"]))
+                self._sumar(dict(p), ordenar=True)
+            if self._obsoletas > len(self._productos):
+                self._compactar()
+
+    # ---------------- consulta ----------------
+
+    def resumen(self) -> Dict[str, int]:
+        """Métricas superiores: stock total, categorías, productos, críticos."""
+        with self._lock:
+            return {
+                "stock_total": self._stock_total,
+                "categorias": len(self._por_categoria),
+                "productos": len(self._productos),
+                "criticos": len(self._criticos),
+            }
+
+    def stock_por_categoria(self) -> Dict[str, int]:
+        with self._lock:
+            return {c: a[0] for c, a in sorted(self._por_categoria.items())}
+
+    def menos_stock(self, n: int = 10) -> List[Dict[str, Any]]:
+        """Los `n` productos con menos stock (a igual stock, menor ID)."""
+        with self._lock:
+            primeros = _primeros(
+                self._menores, n, lambda e: self._generacion.get(e[1]) == e[2]
+            )
+            return [dict(self._productos[pid]) for _, pid, _ in primeros]
+
+    def mas_stock(self, n: int = 10) -> List[Dict[str, Any]]:
+        """Los `n` productos con más stock, de mayor a menor."""
+        with self._lock:
+            primeros = _primeros(
+                self._mayores, n, lambda e: self._generacion.get(-e[1]) == e[2]
+            )
+            return [dict(self._productos[-pid]) for _, pid, _ in primeros]
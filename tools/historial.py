@@ -1,42 +1,386 @@
-import json
+import atexit
 import os
+import queue
+import sys
+import threading
+import time
 from datetime import datetime
 
+from tools.almacenamiento import obtener_almacenamiento
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-HISTORIAL_FILE = os.path.join(BASE_DIR, "../historial.json")
 
+# Un evento JSON por línea, solo se añade al final. El formato antiguo
+# (historial.json, un único JSON {"historial": [...]} reescrito en cada
+# evento) se migra automáticamente al log la primera vez que se usa.
+# (Con INVENTARIO_BACKEND=sqlite se usa historial.db en su lugar.)
+HISTORIAL_LOG = os.path.join(BASE_DIR, "../historial.jsonl")
 
-def cargar_historial():
-    if not os.path.exists(HISTORIAL_FILE):
-        return []
+# Con HISTORIAL_FSYNC=1 cada escritura espera a que el disco confirme.
+HISTORIAL_FSYNC = os.environ.get("HISTORIAL_FSYNC", "0") == "1"
+
+# Escritura asíncrona (group commit): con HISTORIAL_ASINCRONO=1 los eventos
+# se encolan y un hilo los escribe en lotes cada HISTORIAL_INTERVALO
+# segundos o al juntar HISTORIAL_LOTE_MAX eventos. La cola admite como
+# mucho HISTORIAL_COLA_MAX eventos; si se llena, registrar espera.
+HISTORIAL_ASINCRONO = os.environ.get("HISTORIAL_ASINCRONO", "0") == "1"
+HISTORIAL_INTERVALO = float(os.environ.get("HISTORIAL_INTERVALO", "0.2"))
+HISTORIAL_LOTE_MAX = int(os.environ.get("HISTORIAL_LOTE_MAX", "500"))
+HISTORIAL_COLA_MAX = int(os.environ.get("HISTORIAL_COLA_MAX", "10000"))
+
+# Formato de "fecha" en los eventos; al ser de ancho fijo, comparar los
+# textos equivale a comparar las fechas
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+
+
+# ==========================================================
+#   ESCRITOR ASÍNCRONO
+# ==========================================================
+
+_PARAR = object()
+_VACIAR = object()
+
+
+class EscritorAsincrono:
+    """
+    Escribe los eventos del historial desde un hilo en segundo plano,
+    agrupando en una sola escritura los que llegan durante `intervalo`
+    segundos (o hasta `lote_max` eventos).
+
+    - encolar() vuelve enseguida salvo que la cola esté llena.
+    - vaciar() espera a que todo lo encolado esté escrito.
+    - detener() vacía la cola y termina el hilo.
+
+    Si una escritura falla, el lote se reintenta en la siguiente vuelta y
+    vaciar() lanza el error.
+    """
+
+    def __init__(self, escribir, intervalo=HISTORIAL_INTERVALO,
+                 lote_max=HISTORIAL_LOTE_MAX, cola_max=HISTORIAL_COLA_MAX):
+        self._escribir = escribir
+        self._intervalo = intervalo
+        self.lote_max = lote_max
+        # La cola cuenta lotes; el límite en eventos se aplica con el semáforo
+        self._cola = queue.Queue()
+        self._hueco = threading.BoundedSemaphore(max(cola_max, lote_max))
+        self._cond = threading.Condition()
+        self._pendientes = 0
+        self._error = None
+        # Último lote del hilo si no pudo escribirse al detenerlo
+        self._sin_escribir = []
+        self._hilo = threading.Thread(target=self._bucle, name="historial-escritor", daemon=True)
+        self._hilo.start()
+
+    def encolar(self, eventos, fsync=False):
+        for _ in eventos:
+            self._hueco.acquire()
+        with self._cond:
+            self._pendientes += len(eventos)
+        self._cola.put((eventos, fsync))
+
+    def vaciar(self):
+        self._cola.put(_VACIAR)
+        with self._cond:
+            while self._pendientes and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+
+    def detener(self, espera=10):
+        self._cola.put(_PARAR)
+        self._hilo.join(espera)
+
+        # El lote que el hilo no pudo escribir y los encolados por otro
+        # hilo mientras se detenía
+        with self._cond:
+            resto, self._sin_escribir = self._sin_escribir, []
+        while True:
+            try:
+                item = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple):
+                resto.extend(item[0])
+        if resto:
+            try:
+                self._escribir(resto, True)
+            except Exception as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+            else:
+                for _ in resto:
+                    self._hueco.release()
+                with self._cond:
+                    self._pendientes -= len(resto)
+                    self._cond.notify_all()
+
+        with self._cond:
+            pendientes, error = self._pendientes, self._error
+        if pendientes:
+            print(
+                f"[historial] {pendientes} eventos sin escribir al cerrar: {error}",
+                file=sys.stderr,
+            )
 
-    with open(HISTORIAL_FILE, "r", encoding="utf-8") as f:
+    def _recoger(self, bloquear):
+        """
+        Espera el primer lote y agrupa los que lleguen durante el
+        intervalo. Devuelve (eventos, fsync, parar).
+        """
+        eventos, fsync = [], False
         try:
-            data = json.load(f)
-            return data.get("historial", [])
-        except:
-            return []
+            item = self._cola.get(timeout=None if bloquear else self._intervalo)
+        except queue.Empty:
+            return eventos, fsync, False
 
+        limite = time.monotonic() + self._intervalo
+        while True:
+            if item is _PARAR:
+                return eventos, fsync, True
+            if item is _VACIAR:
+                return eventos, fsync, False
+
+            lote, fsync_lote = item
+            eventos.extend(lote)
+            fsync = fsync or fsync_lote
+            if len(eventos) >= self.lote_max:
+                return eventos, fsync, False
+
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return eventos, fsync, False
+            try:
+                item = self._cola.get(timeout=restante)
+            except queue.Empty:
+                return eventos, fsync, False
+
+    def _bucle(self):
+        pendientes, fsync = [], False
+        while True:
+            nuevos, fsync_nuevos, parar = self._recoger(bloquear=not pendientes)
+            pendientes.extend(nuevos)
+            fsync = fsync or fsync_nuevos
+
+            if pendientes:
+                try:
+                    self._escribir(pendientes, fsync)
+                except Exception as e:
+                    with self._cond:
+                        self._error = e
+                        if parar:
+                            self._sin_escribir = pendientes
+                        self._cond.notify_all()
+                    if parar:
+                        return
+                    continue
+
+                for _ in pendientes:
+                    self._hueco.release()
+                with self._cond:
+                    self._pendientes -= len(pendientes)
+                    self._error = None
+                    self._cond.notify_all()
+                pendientes, fsync = [], False
+
+            if parar:
+                return
+
+
+_escritor = None
+_escritor_lock = threading.Lock()
+
+
+def _anexar(eventos, fsync):
+    obtener_almacenamiento().anexar_eventos(HISTORIAL_LOG, eventos, fsync=fsync)
+
+
+def activar_escritura_asincrona(intervalo=None, lote_max=None, cola_max=None):
+    """
+    Pasa a registrar los eventos con el escritor en segundo plano. Al
+    cerrar el proceso se escribe todo lo pendiente.
+    """
+    global _escritor
+    with _escritor_lock:
+        if _escritor is None:
+            _escritor = EscritorAsincrono(
+                _anexar,
+                intervalo=HISTORIAL_INTERVALO if intervalo is None else intervalo,
+                lote_max=HISTORIAL_LOTE_MAX if lote_max is None else lote_max,
+                cola_max=HISTORIAL_COLA_MAX if cola_max is None else cola_max,
+            )
+
+
+def desactivar_escritura_asincrona():
+    """
+    Escribe lo pendiente y vuelve a la escritura síncrona (la de por
+    defecto, y la adecuada para las pruebas).
+    """
+    global _escritor
+    with _escritor_lock:
+        escritor, _escritor = _escritor, None
+    if escritor is not None:
+        escritor.detener()
+
+
+def vaciar_historial():
+    """
+    Espera a que estén escritos los eventos encolados por este proceso.
+    Las lecturas del historial lo llaman antes de consultar.
+    """
+    escritor = _escritor
+    if escritor is not None:
+        escritor.vaciar()
 
-def guardar_historial(historial):
-    with open(HISTORIAL_FILE, "w", encoding="utf-8") as f:
-        json.dump({"historial": historial}, f, indent=2, ensure_ascii=False)
 
+atexit.register(desactivar_escritura_asincrona)
 
-def registrar_evento(usuario, accion, producto_id, campo, valor_anterior, valor_nuevo):
-    historial = cargar_historial()
 
-    evento = {
+# ==========================================================
+#   LECTURA Y REGISTRO
+# ==========================================================
+
+def migrar_historial():
+    """
+    Migración única del historial.json antiguo al log historial.jsonl.
+    No hace nada si el log ya existe o no hay historial antiguo.
+    """
+    return obtener_almacenamiento("json").migrar_historial_antiguo(HISTORIAL_LOG)
+
+
+def iterar_historial():
+    """
+    Recorre el historial evento a evento sin cargarlo entero en memoria.
+    """
+    vaciar_historial()
+    return obtener_almacenamiento().iterar_eventos(HISTORIAL_LOG)
+
+
+def cargar_historial():
+    return list(iterar_historial())
+
+
+def _texto_fecha(fecha):
+    if fecha is None or isinstance(fecha, str):
+        return fecha
+    return fecha.strftime(FORMATO_FECHA)
+
+
+def consultar_historial(desde=None, hasta=None, ultimos=None,
+                        usuario=None, accion=None, producto_id=None, campo=None):
+    """
+    Eventos con desde <= fecha < hasta (datetime o texto
+    "%Y-%m-%d %H:%M:%S"; None = sin límite), en orden cronológico.
+    Con `ultimos` devuelve solo los N más recientes del rango; usuario,
+    accion, producto_id y campo filtran por igualdad (None = todos).
+
+    El rango se localiza por búsqueda binaria en el índice por fecha y los
+    filtros con los índices por usuario/acción/producto/campo, así que el
+    coste depende del resultado y no del historial entero.
+    """
+    vaciar_historial()
+    return obtener_almacenamiento().consultar_eventos(
+        HISTORIAL_LOG, _texto_fecha(desde), _texto_fecha(hasta), ultimos,
+        usuario=usuario, accion=accion, producto_id=producto_id, campo=campo,
+    )
+
+
+def ultimos_eventos(n=20, usuario=None, producto_id=None):
+    """
+    Los N últimos eventos registrados (opcionalmente de un usuario o de un
+    producto), en orden cronológico. Lee el historial hacia atrás desde
+    el final, así que su coste no crece con el tamaño del historial.
+    """
+    vaciar_historial()
+    return obtener_almacenamiento().cola_eventos(
+        HISTORIAL_LOG, n, usuario=usuario, producto_id=producto_id
+    )
+
+
+def historial_producto(producto_id, desde=None, hasta=None):
+    """
+    Línea de tiempo de un producto: todos sus eventos en orden cronológico.
+    """
+    return consultar_historial(desde=desde, hasta=hasta, producto_id=producto_id)
+
+
+def valores_historial(campo):
+    """
+    Valores distintos de usuario, accion, producto_id o campo en el
+    historial (como texto), sin recorrerlo.
+    """
+    vaciar_historial()
+    return obtener_almacenamiento().valores_historial(HISTORIAL_LOG, campo)
+
+
+def version_historial():
+    """
+    Sello de la versión actual del historial, sin leerlo. Cambia con cada
+    evento escrito; sirve como clave de cachés externas (UI).
+    """
+    vaciar_historial()
+    return obtener_almacenamiento().sello_historial(HISTORIAL_LOG)
+
+
+def guardar_historial(historial):
+    """
+    Reescribe el historial completo (solo para mantenimiento;
+    el registro normal de eventos usa registrar_evento).
+    """
+    vaciar_historial()
+    obtener_almacenamiento().reescribir_historial(HISTORIAL_LOG, historial)
+
+
+def registrar_evento(usuario, accion, producto_id, campo, valor_anterior, valor_nuevo, fsync=None):
+    return registrar_eventos([{
         "usuario": usuario,
         "accion": accion,
         "producto_id": producto_id,
         "campo": campo,
         "valor_anterior": valor_anterior,
         "valor_nuevo": valor_nuevo,
-        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
+    }], fsync=fsync)
+
 
-    historial.append(evento)
-    guardar_historial(historial)
+def registrar_eventos(eventos, fsync=None):
+    """
+    Registra una lista de eventos con una sola escritura al log.
+    Cada evento es un dict con usuario, accion, producto_id, campo,
+    valor_anterior y valor_nuevo; si no trae "fecha" se le asigna
+    la misma a todo el lote.
+
+    Con la escritura asíncrona activa los eventos se encolan y la función
+    vuelve sin esperar al disco, salvo con fsync (espera a su lote).
+    """
+    if not eventos:
+        return True
+
+    if fsync is None:
+        fsync = HISTORIAL_FSYNC
+
+    fecha = datetime.now().strftime(FORMATO_FECHA)
+    lote = [
+        evento if "fecha" in evento else {**evento, "fecha": fecha}
+        for evento in eventos
+    ]
+
+    escritor = _escritor
+    if escritor is None:
+        _anexar(lote, fsync)
+        return True
+
+    if len(lote) >= escritor.lote_max:
+        # Un lote grande (p. ej. una importación) ya es un grupo completo
+        escritor.vaciar()
+        _anexar(lote, fsync)
+        return True
+
+    escritor.encolar(lote, fsync)
+    if fsync:
+        escritor.vaciar()
 
     return True
+
+
+if HISTORIAL_ASINCRONO:
+    activar_escritura_asincrona()
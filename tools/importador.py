@@ -1,92 +1,565 @@
-import pandas as pd
+import io
 import json
-from tools.utils import cargar_inventario, guardar_inventario
-from tools.historial import registrar_evento
+import os
+from datetime import datetime
 
+import numpy as np
+import pandas as pd
+from tools.almacenamiento import escritura_atomica
+from tools.utils import cargar_inventario, cargar_inventario_indexado, ejecutar_mutacion
+from tools.historial import FORMATO_FECHA, registrar_eventos
 
-def validar_csv(df):
-    errores = []
 
-    columnas_obligatorias = ["id", "nombre", "precio", "stock", "categoria"]
+COLUMNAS_OBLIGATORIAS = ["id", "nombre", "precio", "stock", "categoria"]
+CAMPOS_ACTUALIZABLES = ["nombre", "precio", "stock", "categoria"]
+
+# Errores de fila que se devuelven como máximo (el resto solo se cuenta)
+MAX_ERRORES = 100
+
+# Filas por bloque en la importación por bloques
+TAMANO_BLOQUE = 50_000
+
 
-    # Validar columnas faltantes
-    faltan = [c for c in columnas_obligatorias if c not in df.columns]
+def _texto_vacio(columna):
+    return columna.isna() | columna.astype(str).str.strip().eq("")
+
+
+def validar_csv(df, max_errores=MAX_ERRORES):
+    """
+    Valida el DataFrame columna a columna (sin recorrer filas en Python).
+    Devuelve la lista de errores, ordenada por fila y limitada a
+    `max_errores` mensajes de fila más un resumen de los omitidos.
+    """
+    errores = []
+
+    # Validar columnas faltantes (sin ellas no se pueden validar las filas)
+    faltan = [c for c in COLUMNAS_OBLIGATORIAS if c not in df.columns]
     if faltan:
         errores.append(f"Faltan columnas obligatorias: {', '.join(faltan)}")
+        return errores
 
-    # Validar filas
-    for idx, row in df.iterrows():
-        if row["id"] <= 0:
-            errores.append(f"Fila {idx}: ID inválido ({row['id']})")
-
-        if not isinstance(row["nombre"], str) or row["nombre"].strip() == "":
-            errores.append(f"Fila {idx}: nombre vacío")
+    # Tipos: lo que no se puede convertir a número queda como NaN
+    ids = pd.to_numeric(df["id"], errors="coerce")
+    precios = pd.to_numeric(df["precio"], errors="coerce")
+    stocks = pd.to_numeric(df["stock"], errors="coerce")
 
-        if row["precio"] <= 0:
-            errores.append(f"Fila {idx}: precio no válido ({row['precio']})")
+    comprobaciones = [
+        (ids.isna() | (ids <= 0) | (ids % 1 != 0),
+         lambda v: f"ID inválido ({v})", df["id"]),
+        (_texto_vacio(df["nombre"]),
+         lambda v: "nombre vacío", None),
+        (precios.isna() | (precios <= 0),
+         lambda v: f"precio no válido ({v})", df["precio"]),
+        (stocks.isna() | (stocks % 1 != 0),
+         lambda v: f"stock no válido ({v})", df["stock"]),
+        (stocks < 0,
+         lambda v: f"stock negativo ({v})", df["stock"]),
+        (_texto_vacio(df["categoria"]),
+         lambda v: "categoría vacía", None),
+    ]
 
-        if row["stock"] < 0:
-            errores.append(f"Fila {idx}: stock negativo ({row['stock']})")
+    # Solo se formatean los primeros `max_errores` de cada comprobación
+    encontrados = []
+    total = 0
+    for orden, (mascara, mensaje, valores) in enumerate(comprobaciones):
+        posiciones = mascara.to_numpy().nonzero()[0]
+        total += len(posiciones)
+        for pos in posiciones[:max_errores]:
+            valor = valores.iat[pos] if valores is not None else None
+            encontrados.append((pos, orden, f"Fila {df.index[pos]}: {mensaje(valor)}"))
 
-        if not isinstance(row["categoria"], str) or row["categoria"].strip() == "":
-            errores.append(f"Fila {idx}: categoría vacía")
+    encontrados.sort()
+    errores.extend(msg for _, _, msg in encontrados[:max_errores])
+    if total > max_errores:
+        errores.append(f"... y {total - max_errores} errores de fila más.")
 
     # IDs duplicados dentro del archivo
-    duplicados = df[df["id"].duplicated()]
+    duplicados = df["id"][ids.duplicated() & ids.notna()]
     if not duplicados.empty:
-        errores.append(f"IDs duplicados en el archivo: {duplicados['id'].tolist()}")
+        errores.append(f"IDs duplicados en el archivo: {duplicados.head(max_errores).tolist()}")
 
     return errores
 
 
-def aplicar_importacion(file_path_json, df, usuario="desconocido"):
-    productos, data = cargar_inventario(file_path_json)
+def normalizar_csv(df):
+    """
+    Deja solo las columnas obligatorias con sus tipos definitivos
+    (id y stock enteros, precio decimal, textos como str). Si un ID
+    aparece varias veces gana la última fila.
+    Se supone que el DataFrame ya pasó validar_csv().
+    """
+    normalizado = pd.DataFrame({
+        "id": pd.to_numeric(df["id"]).astype("int64"),
+        "nombre": df["nombre"].astype(str),
+        "precio": pd.to_numeric(df["precio"]).astype("float64"),
+        "stock": pd.to_numeric(df["stock"]).astype("int64"),
+        "categoria": df["categoria"].astype(str),
+    }, index=df.index)
+    return normalizado.drop_duplicates("id", keep="last")
+
+
+def calcular_diferencias(productos, df):
+    """
+    Cruza el CSV con el catálogo en una sola unión vectorizada por ID.
+
+    Devuelve un dict con:
+    - "entrada":   el CSV normalizado
+    - "nuevos":    filas del CSV cuyo ID no existe en el catálogo
+    - "cambios":   una fila por campo modificado
+                   (producto_id, campo, valor_anterior, valor_nuevo)
+    - "sin_cambios": número de productos existentes que no cambian
+    """
+    entrada = normalizar_csv(df)
+
+    actual = pd.DataFrame(productos, columns=COLUMNAS_OBLIGATORIAS)
+    actual["id"] = actual["id"].astype("int64")
+    actual = actual.set_index("id")
+
+    unido = entrada.merge(
+        actual, how="left", left_on="id", right_index=True,
+        suffixes=("", "_actual"), indicator=True,
+    )
+    existe = (unido["_merge"] == "both").to_numpy()
+
+    partes = []
+    algun_cambio = pd.Series(False, index=unido.index)
+    for campo in CAMPOS_ACTUALIZABLES:
+        cambia = existe & (unido[campo] != unido[campo + "_actual"]).to_numpy()
+        algun_cambio |= cambia
+        if cambia.any():
+            filas = unido.loc[cambia]
+            partes.append(pd.DataFrame({
+                "producto_id": filas["id"].to_numpy(),
+                "campo": campo,
+                # Del catálogo original: tras la unión los enteros pasan a float
+                "valor_anterior": actual.loc[filas["id"], campo].astype(object).to_numpy(),
+                "valor_nuevo": filas[campo].astype(object).to_numpy(),
+            }))
+
+    if partes:
+        cambios = pd.concat(partes, ignore_index=True)
+    else:
+        cambios = pd.DataFrame(columns=["producto_id", "campo", "valor_anterior", "valor_nuevo"])
+
+    return {
+        "entrada": entrada,
+        "nuevos": entrada.loc[~existe],
+        "cambios": cambios,
+        "sin_cambios": int(existe.sum() - algun_cambio.sum()),
+    }
+
 
-    nuevos = 0
-    actualizados = 0
+def _importar(file_path_json, df, usuario="desconocido"):
+    """
+    Aplica el CSV con una escritura del inventario y una del historial.
+    Devuelve el resumen con los contadores de la importación.
+    """
+    resumen, eventos = _aplicar(file_path_json, df, usuario)
 
-    for _, row in df.iterrows():
+    # Toda la auditoría de la importación en una sola escritura
+    registrar_eventos(eventos)
+    resumen["eventos"] = len(eventos)
 
-        existente = next((p for p in productos if p["id"] == int(row["id"])), None)
+    return resumen
 
-        if existente:
-            # Actualizar valores
-            for campo in ["nombre", "precio", "stock", "categoria"]:
-                antes = existente[campo]
-                despues = row[campo]
 
-                if antes != despues:
-                    registrar_evento(
-                        usuario=usuario,
-                        accion="importar_masivo",
-                        producto_id=row["id"],
-                        campo=campo,
-                        valor_anterior=antes,
-                        valor_nuevo=despues
-                    )
+def _aplicar(file_path_json, df, usuario, antes_de_guardar=None):
+    # Escribe el inventario y devuelve (resumen, eventos) sin registrarlos.
+    # `antes_de_guardar(resumen, eventos)` se llama en cada intento, antes
+    # de escribir el inventario.
 
-                    existente[campo] = despues
+    def _mutar(productos, data, indice):
+        diferencias = calcular_diferencias(productos, df)
+        nuevos = diferencias["nuevos"]
+        cambios = diferencias["cambios"]
 
-            actualizados += 1
+        eventos = []
+        modificados = []
 
-        else:
-            # Crear producto nuevo
-            nuevo = row.to_dict()
+        # Actualizaciones: solo los campos que realmente cambian
+        for pid, campo, antes, despues in zip(
+            cambios["producto_id"].tolist(), cambios["campo"].tolist(),
+            cambios["valor_anterior"].tolist(), cambios["valor_nuevo"].tolist(),
+        ):
+            indice[pid][campo] = despues
+            eventos.append({
+                "usuario": usuario,
+                "accion": "importar_masivo",
+                "producto_id": pid,
+                "campo": campo,
+                "valor_anterior": antes,
+                "valor_nuevo": despues,
+            })
+        actualizados = cambios["producto_id"].unique().tolist()
+        modificados.extend(actualizados)
+
+        # Productos nuevos
+        for nuevo in nuevos.to_dict("records"):
             productos.append(nuevo)
+            indice[nuevo["id"]] = nuevo
+            modificados.append(nuevo["id"])
 
             for campo, valor in nuevo.items():
-                registrar_evento(
-                    usuario=usuario,
-                    accion="importar_nuevo_producto",
-                    producto_id=row["id"],
-                    campo=campo,
-                    valor_anterior=None,
-                    valor_nuevo=valor
-                )
+                eventos.append({
+                    "usuario": usuario,
+                    "accion": "importar_nuevo_producto",
+                    "producto_id": nuevo["id"],
+                    "campo": campo,
+                    "valor_anterior": None,
+                    "valor_nuevo": valor,
+                })
+
+        data["productos"] = productos
+
+        resumen = {
+            "filas": len(diferencias["entrada"]),
+            "nuevos": len(nuevos),
+            "actualizados": len(actualizados),
+            "sin_cambios": diferencias["sin_cambios"],
+            "campos_modificados": cambios["campo"].value_counts().to_dict(),
+        }
+        if antes_de_guardar is not None:
+            antes_de_guardar(resumen, eventos)
+        return modificados, (resumen, eventos)
+
+    # Una sola escritura del inventario (se repite si otro proceso escribió antes)
+    return ejecutar_mutacion(file_path_json, _mutar)
+
+
+def formatear_resumen(resumen):
+    texto = (
+        f"Importación completada: {resumen['nuevos']} nuevos, "
+        f"{resumen['actualizados']} actualizados, {resumen['sin_cambios']} sin cambios."
+    )
+    if resumen["campos_modificados"]:
+        detalle = ", ".join(f"{c}={n}" for c, n in sorted(resumen["campos_modificados"].items()))
+        texto += f" Campos modificados: {detalle}."
+    return texto
+
+
+def aplicar_importacion(file_path_json, df, usuario="desconocido"):
+    return formatear_resumen(_importar(file_path_json, df, usuario))
+
+
+def previsualizar_importacion(file_path_json, df):
+    """
+    Simulación de aplicar_importacion: no escribe nada.
+
+    Devuelve un dict con:
+    - "resumen": los mismos contadores que la importación real
+    - "cambios": DataFrame con una fila por campo modificado, su categoría
+      y, en los precios, la diferencia absoluta y relativa
+    - "nuevos":  DataFrame con los productos que se crearían
+    - "precios_por_categoria": cambios de precio agregados por categoría
+      (número, variación media, mínima, máxima y media en %)
+    """
+    productos, _ = cargar_inventario(file_path_json)
+    diferencias = calcular_diferencias(productos, df)
+    cambios = diferencias["cambios"]
+
+    # Categoría de destino de cada cambio (la del CSV)
+    categorias = diferencias["entrada"].set_index("id")["categoria"]
+    cambios = cambios.assign(categoria=categorias.reindex(cambios["producto_id"]).to_numpy())
+
+    es_precio = (cambios["campo"] == "precio").to_numpy()
+    anterior = pd.to_numeric(cambios["valor_anterior"].where(es_precio), errors="coerce")
+    nuevo = pd.to_numeric(cambios["valor_nuevo"].where(es_precio), errors="coerce")
+    cambios["delta"] = nuevo - anterior
+    cambios["delta_pct"] = (cambios["delta"] / anterior * 100).round(2)
+
+    precios_por_categoria = (
+        cambios[es_precio]
+        .groupby("categoria")
+        .agg(
+            cambios=("delta", "size"),
+            delta_medio=("delta", "mean"),
+            delta_min=("delta", "min"),
+            delta_max=("delta", "max"),
+            delta_pct_medio=("delta_pct", "mean"),
+        )
+        .round(2)
+        .sort_values("cambios", ascending=False)
+    )
+
+    resumen = {
+        "filas": len(diferencias["entrada"]),
+        "nuevos": len(diferencias["nuevos"]),
+        "actualizados": int(cambios["producto_id"].nunique()),
+        "sin_cambios": diferencias["sin_cambios"],
+        "campos_modificados": cambios["campo"].value_counts().to_dict(),
+    }
+
+    return {
+        "resumen": resumen,
+        "cambios": cambios,
+        "nuevos": diferencias["nuevos"],
+        "precios_por_categoria": precios_por_categoria,
+    }
+
+
+# ==========================================================
+#   IMPORTACIÓN POR BLOQUES (ARCHIVOS GRANDES)
+# ==========================================================
+
+def _ruta_progreso(ruta_csv):
+    return ruta_csv + ".progreso.json"
+
+
+def _ruta_ids(ruta_csv):
+    # IDs ya aplicados (int64), solo se añaden al final
+    return ruta_csv + ".progreso.ids"
+
+
+def _leer_ids(ruta_csv, cuantos):
+    """IDs de los bloques aplicados según el avance (descarta lo que sobre)."""
+    if not cuantos:
+        return np.empty(0, dtype="int64")
+    with open(_ruta_ids(ruta_csv), "r+b") as f:
+        if os.fstat(f.fileno()).st_size < cuantos * 8:
+            raise ValueError("faltan IDs en el avance")
+        # Lo escrito tras el último avance guardado no llegó a contar
+        f.truncate(cuantos * 8)
+        return np.fromfile(f, dtype="int64")
+
+
+def _ruta_bloque(ruta_csv):
+    # Bloque en curso: sus eventos se anotan antes de guardar el inventario
+    return ruta_csv + ".progreso.bloque"
+
+
+def _anotar_bloque(ruta_csv, bloque, eventos):
+    # Primera línea: datos del bloque; después, un evento por línea
+    with escritura_atomica(_ruta_bloque(ruta_csv)) as f:
+        for registro in [bloque, *eventos]:
+            f.write(json.dumps(registro, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+def _leer_bloque(ruta_csv):
+    try:
+        with open(_ruta_bloque(ruta_csv), "r", encoding="utf-8") as f:
+            registros = [json.loads(linea) for linea in f]
+    except (OSError, ValueError):
+        return None
+    if not registros:
+        return None
+    return registros[0], registros[1:]
+
+
+def _bloque_guardado(file_path_json, eventos):
+    """
+    True si el inventario refleja los eventos anotados de un bloque: algún
+    producto nuevo existe o algún campo ya no tiene su valor anterior.
+    """
+    _, _, indice, _ = cargar_inventario_indexado(file_path_json)
+    for evento in eventos:
+        producto = indice.get(evento["producto_id"])
+        if producto is None:
+            continue
+        if evento["valor_anterior"] is None or producto.get(evento["campo"]) != evento["valor_anterior"]:
+            return True
+    return False
+
+
+def _avanzar(ruta_csv, progreso, bloque, ids):
+    # Suma el bloque aplicado al avance y lo guarda
+    total = progreso["resumen"]
+    for clave in ("nuevos", "actualizados", "sin_cambios"):
+        total[clave] += bloque["resumen"][clave]
+    for campo, veces in bloque["resumen"]["campos_modificados"].items():
+        total["campos_modificados"][campo] = total["campos_modificados"].get(campo, 0) + veces
+
+    with open(_ruta_ids(ruta_csv), "ab") as f:
+        np.asarray(ids, dtype="int64").tofile(f)
+    progreso["ids"] += len(ids)
+    progreso["posicion"] = bloque["fin"]
+    progreso["bloques"] += 1
+    progreso["filas"] += bloque["filas"]
+    _guardar_progreso(ruta_csv, progreso)
+
+
+def _leer_progreso(ruta_csv, firma):
+    try:
+        with open(_ruta_progreso(ruta_csv), "r", encoding="utf-8") as f:
+            progreso = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # Solo se reanuda sobre el mismo archivo
+    if progreso.get("firma") != firma or "posicion" not in progreso:
+        return None
+    return progreso
+
+
+def _guardar_progreso(ruta_csv, progreso):
+    with escritura_atomica(_ruta_progreso(ruta_csv)) as f:
+        f.write(json.dumps(progreso, ensure_ascii=False).encode("utf-8"))
+
+
+def _bloques_csv(ruta_csv, tamano_bloque, posicion=0):
+    """
+    Recorre el CSV en bloques de `tamano_bloque` registros desde el byte
+    `posicion` (0 = tras la cabecera). Devuelve (bytes, fin): el bloque
+    con la cabecera delante, listo para read_csv, y la posición del byte
+    siguiente, desde la que se puede reanudar sin releer lo anterior.
+
+    Un registro termina en un salto de línea con las comillas cerradas
+    (número par de comillas), así que los campos entre comillas pueden
+    contener saltos de línea.
+    """
+    with open(ruta_csv, "rb") as f:
+        cabecera = b""
+        comillas = 0
+        for linea in f:
+            cabecera += linea
+            comillas += linea.count(b'"')
+            if comillas % 2 == 0:
+                break
+
+        pos = max(posicion, len(cabecera))
+        f.seek(pos)
+
+        lineas = []
+        registros = 0
+        comillas = 0
+        for linea in f:
+            lineas.append(linea)
+            pos += len(linea)
+            comillas += linea.count(b'"')
+            if comillas % 2:
+                continue
+            comillas = 0
+            registros += 1
+            if registros == tamano_bloque:
+                yield cabecera + b"".join(lineas), pos
+                lineas = []
+                registros = 0
+
+        if any(linea.strip() for linea in lineas):
+            yield cabecera + b"".join(lineas), pos
+
+
+def importar_csv_por_bloques(
+    file_path_json,
+    ruta_csv,
+    usuario="desconocido",
+    tamano_bloque=TAMANO_BLOQUE,
+    reanudar=True,
+    al_progresar=None,
+):
+    """
+    Importa un CSV grande leyéndolo en bloques de `tamano_bloque` filas:
+    cada bloque se valida y se aplica (una escritura de inventario y una
+    de historial por bloque), así que la memoria depende del bloque y no
+    del archivo.
+
+    Tras cada bloque se guarda el avance en `<csv>.progreso.json` con la
+    posición (byte) del primer registro no aplicado; si la importación se
+    interrumpe, la siguiente llamada continúa desde ahí sin releer lo ya
+    aplicado.
+
+    Los eventos de auditoría de un bloque se anotan en
+    `<csv>.progreso.bloque` antes de guardar el inventario, y se borran
+    después de registrarlos. Al reanudar con esa anotación pendiente: si
+    el inventario refleja el bloque, se completa el avance y se registran
+    sus eventos; si no, el bloque no llegó a aplicarse y se repite. Una
+    caída puede duplicar los eventos de un bloque, no perderlos.
+
+    Si un bloque no pasa validar_csv(), o repite IDs de bloques
+    anteriores, la importación se detiene antes de aplicarlo y se
+    devuelven sus errores; los bloques anteriores quedan aplicados.
+    `al_progresar(progreso)` se llama después de cada bloque aplicado.
+    """
+    st = os.stat(ruta_csv)
+    firma = {"tamano": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    progreso = _leer_progreso(ruta_csv, firma) if reanudar else None
+    if progreso is None:
+        progreso = {
+            "firma": firma,
+            "posicion": 0,
+            "bloques": 0,
+            "filas": 0,
+            "ids": 0,
+            "resumen": {"nuevos": 0, "actualizados": 0, "sin_cambios": 0,
+                        "campos_modificados": {}},
+        }
+        anotado = None
+        _guardar_progreso(ruta_csv, progreso)
+    else:
+        anotado = _leer_bloque(ruta_csv)
+
+    # IDs de los bloques ya aplicados, para detectar duplicados entre bloques
+    try:
+        vistos = set(_leer_ids(ruta_csv, progreso["ids"]).tolist())
+    except (OSError, ValueError):
+        return "No se pudo leer el avance de la importación; vuelve a importar sin reanudar."
+    if not progreso["ids"]:
+        open(_ruta_ids(ruta_csv), "wb").close()
+
+    # Bloque anotado de una importación interrumpida
+    if anotado is not None:
+        bloque, eventos = anotado
+        if bloque["desde"] == progreso["posicion"]:
+            # Sin avance guardado: solo cuenta si el inventario llegó a guardarse
+            if _bloque_guardado(file_path_json, eventos):
+                _avanzar(ruta_csv, progreso, bloque, bloque["ids"])
+                vistos.update(bloque["ids"])
+            else:
+                eventos = []
+        elif bloque["fin"] != progreso["posicion"]:
+            eventos = []
+        if eventos:
+            registrar_eventos(eventos, fsync=True)
+    if os.path.exists(_ruta_bloque(ruta_csv)):
+        os.remove(_ruta_bloque(ruta_csv))
+
+    for datos, fin in _bloques_csv(ruta_csv, tamano_bloque, progreso["posicion"]):
+        n = progreso["bloques"]
+        bloque = pd.read_csv(io.BytesIO(datos), dtype={"nombre": str, "categoria": str})
+        # Numeración de filas del archivo completo, como en la importación entera
+        bloque.index += progreso["filas"]
+
+        errores = validar_csv(bloque)
+        if not errores:
+            ids = pd.to_numeric(bloque["id"]).astype("int64")
+            repetidos = ids[ids.isin(vistos)].unique().tolist()
+            if repetidos:
+                errores = [
+                    f"IDs duplicados en el archivo (ya aparecían en bloques anteriores): "
+                    f"{repetidos[:MAX_ERRORES]}"
+                ]
+        if errores:
+            _guardar_progreso(ruta_csv, progreso)
+            return (
+                f"Importación detenida en el bloque {n + 1} "
+                f"({progreso['filas']} filas ya aplicadas):\n- " + "\n- ".join(errores)
+            )
+
+        fecha = datetime.now().strftime(FORMATO_FECHA)
+        anotacion = {"desde": progreso["posicion"], "fin": fin, "filas": len(bloque)}
+
+        def _anotar(resumen, eventos):
+            # Se repite con cada reintento de la escritura del inventario
+            anotacion["resumen"] = resumen
+            anotacion["ids"] = ids.tolist()
+            _anotar_bloque(ruta_csv, anotacion, [{**e, "fecha": fecha} for e in eventos])
+
+        _, eventos = _aplicar(file_path_json, bloque, usuario, antes_de_guardar=_anotar)
+        eventos = [{**evento, "fecha": fecha} for evento in eventos]
+
+        vistos.update(ids.tolist())
+        _avanzar(ruta_csv, progreso, anotacion, ids.to_numpy())
+
+        registrar_eventos(eventos, fsync=True)
+        os.remove(_ruta_bloque(ruta_csv))
 
-            nuevos += 1
+        if al_progresar is not None:
+            al_progresar(progreso)
 
-    data["productos"] = productos
-    guardar_inventario(file_path_json, data)
+    os.remove(_ruta_progreso(ruta_csv))
+    os.remove(_ruta_ids(ruta_csv))
 
-    return f"Importación completada: {nuevos} nuevos, {actualizados} actualizados."
+    return (
+        formatear_resumen(progreso["resumen"]) +
+        f" ({progreso['filas']} filas en {progreso['bloques']} bloques)"
+    )
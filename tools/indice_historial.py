@@ -0,0 +1,567 @@
+import gzip
+import io
+import json
+import os
+import threading
+import uuid
+import zlib
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Campos del evento con índice secundario (valor → posiciones de evento)
+CAMPOS_INDEXADOS = ("usuario", "accion", "producto_id", "campo")
+
+VERSION_DIARIO = 2
+
+# Bytes del principio y del final de la zona indexada que forman su huella
+TAMANO_HUELLA = 4096
+
+
+def _clave(valor: Any) -> str:
+    # Las claves se guardan como texto: el producto_id 89 y "89" son el mismo
+    return "" if valor is None else str(valor)
+
+
+def coincide(evento: Dict[str, Any], filtros: Dict[str, Any]) -> bool:
+    """True si el evento cumple los filtros por igualdad (None = cualquiera)."""
+    return all(
+        valor is None or _clave(evento.get(campo)) == _clave(valor)
+        for campo, valor in filtros.items()
+    )
+
+
+def huella(f, fin: int) -> List[int]:
+    """
+    Huella del contenido [0, fin) de un archivo binario: CRC de sus
+    primeros y últimos TAMANO_HUELLA bytes. Distingue un log reemplazado
+    aunque el sistema de archivos reutilice el mismo número de inodo.
+    """
+    f.seek(0)
+    primeros = f.read(min(fin, TAMANO_HUELLA))
+    inicio_final = max(0, fin - TAMANO_HUELLA)
+    f.seek(inicio_final)
+    ultimos = f.read(fin - inicio_final)
+    return [zlib.crc32(primeros), zlib.crc32(ultimos)]
+
+
+def lineas_al_reves(f, tamano_bloque: int = 1 << 16) -> Iterator[bytes]:
+    """
+    Líneas no vacías de un archivo binario, de la última a la primera,
+    leyendo bloques hacia atrás desde el final.
+    """
+    pos = f.seek(0, os.SEEK_END)
+    resto = b""
+    while pos > 0:
+        leer = min(tamano_bloque, pos)
+        pos -= leer
+        f.seek(pos)
+        lineas = (f.read(leer) + resto).split(b"\n")
+        resto = lineas[0]
+        for linea in reversed(lineas[1:]):
+            if linea.strip():
+                yield linea
+    if resto.strip():
+        yield resto
+
+
+class IndiceTemporal:
+    """
+    Índice del log historial.jsonl: para cada evento guarda su fecha y la
+    posición (byte) donde empieza su línea, y por cada campo de
+    CAMPOS_INDEXADOS una lista de postings valor → números de evento.
+
+    Las consultas por rango o "últimos N" buscan el inicio con bisect; las
+    filtradas por usuario, acción, campo o producto cruzan los postings.
+    En ambos casos solo se leen del log las líneas del resultado.
+
+    El índice solo se extiende con lo añadido al final del log desde la
+    última consulta; si el archivo se reemplaza o encoge (otro inodo, o
+    el mismo con otra huella) se reconstruye.
+
+    Con persistente=True se puede guardar en disco como un diario: una
+    cabecera y un lote por guardado con los eventos indexados desde el
+    anterior (pendiente_de_guardar/marcar_guardado), así que cada
+    guardado cuesta lo que se añadió y no el índice entero. desde_diario()
+    lo restaura al arrancar.
+
+    El log se escribe en orden cronológico; si aparece una fecha anterior
+    a la última (p. ej. un historial importado), las consultas dejan de
+    usar bisect y filtran sobre las fechas del índice.
+    """
+
+    def __init__(self, persistente: bool = False):
+        self._lock = threading.Lock()
+        self._persistente = persistente
+        self._generacion = 0
+        self._reiniciar(None)
+
+    def _reiniciar(self, identidad) -> None:
+        self._identidad = identidad
+        self._fechas: List[str] = []
+        self._offsets: List[int] = []
+        self._postings: Dict[str, Dict[str, List[int]]] = {c: {} for c in CAMPOS_INDEXADOS}
+        self._fin = 0
+        self._huella: Optional[List[int]] = None
+        self._ordenado = True
+        # Diario en disco: su identificador (None = hay que reescribirlo
+        # entero), eventos ya guardados en él y valores de los campos
+        # indexados de los que faltan por guardar
+        self._generacion += 1
+        self._diario: Optional[str] = None
+        self._guardados = 0
+        self._valores_pendientes: List[List[str]] = []
+
+    @property
+    def sin_persistir(self) -> int:
+        """Eventos indexados que aún no están en el diario."""
+        return len(self._fechas) - self._guardados if self._persistente else 0
+
+    # ---------------- persistencia ----------------
+
+    @property
+    def diario(self) -> Optional[str]:
+        """Identificador del diario en disco (None = hay que reescribirlo)."""
+        return self._diario
+
+    @property
+    def guardados(self) -> int:
+        """Eventos que ya están en el diario."""
+        return self._guardados
+
+    def pendiente_de_guardar(self, desde: Optional[int] = None) -> Tuple[bool, List[Dict[str, Any]], Any]:
+        """
+        Líneas del diario que faltan por escribir: (completo, líneas, marca).
+        Con completo=True el diario se reescribe entero con ellas (cabecera
+        y todo el índice); si no, se añaden al final del existente. Una vez
+        escritas se llama a marcar_guardado(marca).
+
+        `desde` (≥ guardados) empieza el lote en ese evento, cuando el
+        diario en disco ya tiene los anteriores (los añadió otro proceso
+        que indexa el mismo log).
+        """
+        with self._lock:
+            hasta = len(self._fechas)
+            desde = self._guardados if desde is None else min(max(desde, self._guardados), hasta)
+            completo = self._diario is None
+            diario = uuid.uuid4().hex if completo else self._diario
+            marca = (self._generacion, hasta, diario)
+            if not self._persistente or (hasta == desde and not completo):
+                return completo, [], marca
+
+            lineas = []
+            if completo:
+                lineas.append({
+                    "version": VERSION_DIARIO,
+                    "diario": diario,
+                    "identidad": list(self._identidad) if self._identidad else None,
+                })
+            lineas.append({
+                "diario": diario,
+                "desde": desde,
+                "fin": self._fin,
+                "huella": self._huella,
+                "ordenado": self._ordenado,
+                "fechas": self._fechas[desde:hasta],
+                "offsets": self._offsets[desde:hasta],
+                "valores": self._valores_pendientes[desde - self._guardados:hasta - self._guardados],
+            })
+            return completo, lineas, marca
+
+    def marcar_guardado(self, marca) -> None:
+        """Anota que las líneas de pendiente_de_guardar() ya están en disco."""
+        generacion, hasta, diario = marca
+        with self._lock:
+            if generacion != self._generacion or hasta < self._guardados:
+                return  # el índice se reconstruyó entretanto
+            del self._valores_pendientes[:hasta - self._guardados]
+            self._guardados = hasta
+            self._diario = diario
+
+    def rehacer_diario(self) -> None:
+        """
+        Hace que el próximo guardado reescriba el diario entero (p. ej.
+        si el archivo desapareció). Los valores de cada evento se
+        recuperan de los postings.
+        """
+        with self._lock:
+            valores = [[""] * len(CAMPOS_INDEXADOS) for _ in self._fechas]
+            for i, campo in enumerate(CAMPOS_INDEXADOS):
+                for valor, lista in self._postings[campo].items():
+                    for k in lista:
+                        valores[k][i] = valor
+            self._valores_pendientes = valores
+            self._guardados = 0
+            self._diario = None
+
+    @classmethod
+    def desde_diario(cls, lineas: Iterable[bytes], decodificar=json.loads) -> "IndiceTemporal":
+        """
+        Restaura un índice guardado como diario. Los lotes se aplican
+        mientras encadenen con el anterior; uno incompleto (escritura
+        interrumpida) o de otro diario termina la restauración y lo que
+        falte se indexa desde el log. Sin cabecera válida se devuelve un
+        índice vacío.
+        """
+        indice = cls(persistente=True)
+        lineas = iter(lineas)
+        try:
+            cabecera = decodificar(next(lineas))
+            if cabecera.get("version") != VERSION_DIARIO or not cabecera.get("identidad"):
+                return indice
+            diario = cabecera["diario"]
+            identidad = tuple(cabecera["identidad"])
+        except (StopIteration, AttributeError, KeyError, TypeError, ValueError):
+            return indice
+
+        indice._identidad = identidad
+        completo = True
+        for linea in lineas:
+            if not linea.strip():
+                continue
+            try:
+                lote = decodificar(linea)
+                fechas, offsets, valores = lote["fechas"], lote["offsets"], lote["valores"]
+                if (lote["diario"] != diario or lote["desde"] != len(indice._fechas)
+                        or not len(fechas) == len(offsets) == len(valores)
+                        or any(len(v) != len(CAMPOS_INDEXADOS) for v in valores)):
+                    completo = False
+                    break
+                fin, huella_lote = int(lote["fin"]), list(lote["huella"] or [])
+            except (AttributeError, KeyError, TypeError, ValueError):
+                completo = False
+                break
+
+            k = len(indice._fechas)
+            indice._fechas.extend(fechas)
+            indice._offsets.extend(offsets)
+            for j, fila in enumerate(valores):
+                for campo, valor in zip(CAMPOS_INDEXADOS, fila):
+                    indice._postings[campo].setdefault(valor, []).append(k + j)
+            indice._fin = fin
+            indice._huella = huella_lote or None
+            indice._ordenado = bool(lote.get("ordenado", True))
+
+        indice._diario = diario
+        indice._guardados = len(indice._fechas)
+        if not completo:
+            # Lo que sigue al último lote válido no se podría leer nunca:
+            # el próximo guardado reescribe el diario entero
+            indice.rehacer_diario()
+        return indice
+
+
+    # ---------------- mantenimiento ----------------
+
+    def _ponerse_al_dia(self, f, identidad, tamano: int) -> None:
+        if identidad != self._identidad or tamano < self._fin:
+            self._reiniciar(identidad)
+        elif self._fin > 0 and huella(f, self._fin) != self._huella:
+            # Mismo inodo (reutilizado tras un reemplazo) con otro contenido
+            self._reiniciar(identidad)
+        if tamano == self._fin:
+            return
+
+        f.seek(self._fin)
+        pos = self._fin
+        for linea in f:
+            # Una línea sin salto final es una escritura en curso o
+            # interrumpida: se indexará cuando esté completa
+            if not linea.endswith(b"\n"):
+                break
+            self._indexar(linea, pos)
+            pos += len(linea)
+        if pos != self._fin:
+            self._fin = pos
+            self._huella = huella(f, pos)
+
+    def _indexar(self, linea: bytes, pos: int) -> None:
+        try:
+            evento = json.loads(linea)
+        except ValueError:
+            return
+        if not isinstance(evento, dict):
+            return
+
+        k = len(self._fechas)
+        fecha = _clave(evento.get("fecha"))
+        if self._fechas and fecha < self._fechas[-1]:
+            self._ordenado = False
+        self._fechas.append(fecha)
+        self._offsets.append(pos)
+
+        valores = [_clave(evento.get(campo)) for campo in CAMPOS_INDEXADOS]
+        for campo, valor in zip(CAMPOS_INDEXADOS, valores):
+            self._postings[campo].setdefault(valor, []).append(k)
+        if self._persistente:
+            self._valores_pendientes.append(valores)
+
+    # ---------------- consulta ----------------
+
+    def _candidatos(self, filtros: Dict[str, Any]) -> Optional[List[int]]:
+        """
+        Números de evento (ordenados) que cumplen todos los filtros, o
+        None si no hay filtros.
+        """
+        if not filtros:
+            return None
+
+        listas = []
+        for campo, valor in filtros.items():
+            lista = self._postings[campo].get(_clave(valor))
+            if not lista:
+                return []
+            listas.append(lista)
+
+        listas.sort(key=len)
+        if len(listas) == 1:
+            return listas[0]
+        resto = [set(lista) for lista in listas[1:]]
+        return [k for k in listas[0] if all(k in s for s in resto)]
+
+    def _posiciones(self, desde: Optional[str], hasta: Optional[str],
+                    ultimos: Optional[int], filtros: Dict[str, Any]) -> List[int]:
+        fechas = self._fechas
+        candidatos = self._candidatos(filtros)
+
+        if self._ordenado:
+            i = bisect_left(fechas, desde) if desde is not None else 0
+            j = bisect_left(fechas, hasta) if hasta is not None else len(fechas)
+            if candidatos is None:
+                if ultimos is not None:
+                    i = max(i, j - ultimos)
+                return list(range(i, j))
+            # Los postings están en orden de evento, que aquí es cronológico
+            a, b = bisect_left(candidatos, i), bisect_left(candidatos, j)
+            if ultimos is not None:
+                a = max(a, b - ultimos)
+            return candidatos[a:b]
+
+        if candidatos is None:
+            candidatos = range(len(fechas))
+        posiciones = [
+            k for k in candidatos
+            if (desde is None or fechas[k] >= desde) and (hasta is None or fechas[k] < hasta)
+        ]
+        posiciones.sort(key=fechas.__getitem__)
+        if ultimos is not None:
+            posiciones = posiciones[max(0, len(posiciones) - ultimos):]
+        return posiciones
+
+    def consultar(self, ruta: str, desde: Optional[str] = None, hasta: Optional[str] = None,
+                  ultimos: Optional[int] = None, **filtros) -> List[Dict[str, Any]]:
+        """
+        Eventos con desde <= fecha < hasta, en orden cronológico. Con
+        `ultimos` se devuelven solo los N más recientes del rango.
+        Los filtros (usuario=, accion=, producto_id=, campo=) se resuelven
+        con los índices secundarios.
+        """
+        try:
+            f = open(ruta, "rb")
+        except FileNotFoundError:
+            return []
+
+        with f:
+            st = os.fstat(f.fileno())
+            return self.consultar_abierto(f, (st.st_dev, st.st_ino), st.st_size,
+                                          desde, hasta, ultimos, **filtros)
+
+    def consultar_abierto(self, f, identidad, tamano: int, desde: Optional[str] = None,
+                          hasta: Optional[str] = None, ultimos: Optional[int] = None,
+                          **filtros) -> List[Dict[str, Any]]:
+        """
+        Como consultar(), sobre un archivo binario ya abierto (o un BytesIO)
+        de `tamano` bytes; `identidad` cambia si el contenido se reemplaza.
+        """
+        desconocidos = set(filtros) - set(CAMPOS_INDEXADOS)
+        if desconocidos:
+            raise TypeError(f"Filtros no indexados: {', '.join(sorted(desconocidos))}")
+        filtros = {c: v for c, v in filtros.items() if v is not None}
+
+        with self._lock:
+            self._ponerse_al_dia(f, identidad, tamano)
+            posiciones = self._posiciones(desde, hasta, ultimos, filtros)
+            if not posiciones:
+                return []
+
+            if self._ordenado and posiciones[-1] - posiciones[0] + 1 == len(posiciones):
+                # Resultado contiguo: una sola lectura
+                inicio = self._offsets[posiciones[0]]
+                fin = (self._offsets[posiciones[-1] + 1]
+                       if posiciones[-1] + 1 < len(self._offsets) else self._fin)
+                f.seek(inicio)
+                lineas = f.read(fin - inicio).splitlines()
+            else:
+                lineas = []
+                for k in posiciones:
+                    f.seek(self._offsets[k])
+                    lineas.append(f.readline())
+
+        eventos = []
+        for linea in lineas:
+            try:
+                evento = json.loads(linea)
+            except ValueError:
+                continue
+            if isinstance(evento, dict):
+                eventos.append(evento)
+        return eventos
+
+    def valores(self, ruta: str, campo: str) -> List[str]:
+        """Valores distintos (como texto) de un campo indexado."""
+        try:
+            f = open(ruta, "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            st = os.fstat(f.fileno())
+            return self.valores_abierto(f, (st.st_dev, st.st_ino), st.st_size, campo)
+
+    def valores_abierto(self, f, identidad, tamano: int, campo: str) -> List[str]:
+        with self._lock:
+            self._ponerse_al_dia(f, identidad, tamano)
+            return list(self._postings[campo])
+
+    def primera_fecha(self) -> Optional[str]:
+        """Fecha del primer evento indexado (tras la última consulta)."""
+        with self._lock:
+            return self._fechas[0] if self._fechas else None
+
+
+# ==========================================================
+#   SEGMENTOS MENSUALES
+# ==========================================================
+# El log activo (historial.jsonl) se cierra por meses en segmentos
+# comprimidos historial.AAAA-MM.jsonl.gz (ver AlmacenamientoJSON). Un
+# segmento recibe los eventos escritos mientras su mes era el activo: un
+# evento con fecha atrasada se queda en el tramo en curso, así que un
+# segmento nunca contiene fechas posteriores a su mes (sí anteriores).
+
+def mes(fecha: str) -> str:
+    return fecha[:7]
+
+
+def dividir_por_mes(lineas: Iterable[bytes]) -> List[Tuple[str, List[bytes]]]:
+    """
+    Reparte las líneas del log en tramos mensuales consecutivos
+    [(AAAA-MM, líneas)]. Un tramo empieza con el primer evento de un mes
+    posterior al del tramo anterior; las líneas ilegibles se quedan en el
+    tramo en que aparecen.
+    """
+    tramos: List[Tuple[str, List[bytes]]] = []
+    pendientes: List[bytes] = []
+
+    for linea in lineas:
+        if not linea.strip():
+            continue
+        if not linea.endswith(b"\n"):
+            linea += b"\n"
+        try:
+            evento = json.loads(linea)
+            mes_evento = mes(str(evento.get("fecha") or ""))
+        except (ValueError, AttributeError):
+            mes_evento = ""
+
+        if mes_evento and (not tramos or mes_evento > tramos[-1][0]):
+            tramos.append((mes_evento, pendientes))
+            pendientes = []
+        if tramos:
+            tramos[-1][1].append(linea)
+        else:
+            pendientes.append(linea)
+
+    if pendientes:
+        if tramos:
+            tramos[-1][1].extend(pendientes)
+        else:
+            tramos.append(("", pendientes))
+    return tramos
+
+
+def resumen_tramo(lineas: List[bytes]) -> Dict[str, Any]:
+    """
+    Resumen de un segmento para el manifiesto: fecha mínima y valores
+    distintos de los campos indexados.
+    """
+    desde = None
+    valores: Dict[str, set] = {c: set() for c in CAMPOS_INDEXADOS}
+    for linea in lineas:
+        try:
+            evento = json.loads(linea)
+        except ValueError:
+            continue
+        if not isinstance(evento, dict):
+            continue
+        fecha = _clave(evento.get("fecha"))
+        if desde is None or fecha < desde:
+            desde = fecha
+        for campo in CAMPOS_INDEXADOS:
+            valores[campo].add(_clave(evento.get(campo)))
+    return {"desde": desde, "valores": {c: sorted(v) for c, v in valores.items()}}
+
+
+def puede_contener(resumen: Optional[Dict[str, Any]], hasta: Optional[str],
+                   filtros: Dict[str, Any]) -> bool:
+    """
+    False si el resumen del manifiesto garantiza que el segmento no tiene
+    eventos anteriores a `hasta` o que cumplan los filtros. Sin resumen
+    no se puede descartar.
+    """
+    if not resumen:
+        return True
+    if hasta is not None and resumen.get("desde") is not None and resumen["desde"] >= hasta:
+        return False
+    valores = resumen.get("valores") or {}
+    for campo, valor in filtros.items():
+        if valor is not None and campo in valores and _clave(valor) not in valores[campo]:
+            return False
+    return True
+
+
+class SegmentoCerrado:
+    """
+    Segmento mensual cerrado del historial. Es inmutable: se descomprime
+    en memoria la primera vez que una consulta lo necesita y se indexa
+    igual que el log activo (fechas + índices secundarios).
+    """
+
+    def __init__(self, ruta: str, mes: str, identidad):
+        self.ruta = ruta
+        self.mes = mes
+        self.identidad = identidad
+        self._lock = threading.Lock()
+        self._datos: Optional[bytes] = None
+        self._indice: Optional[IndiceTemporal] = None
+
+    @property
+    def cargado(self) -> bool:
+        return self._datos is not None
+
+    def _cargar(self) -> Tuple[bytes, IndiceTemporal]:
+        with self._lock:
+            if self._datos is None:
+                with gzip.open(self.ruta, "rb") as f:
+                    self._datos = f.read()
+                self._indice = IndiceTemporal()
+            return self._datos, self._indice
+
+    def descargar(self) -> None:
+        with self._lock:
+            self._datos = None
+            self._indice = None
+
+    def consultar(self, desde=None, hasta=None, ultimos=None, **filtros) -> List[Dict[str, Any]]:
+        datos, indice = self._cargar()
+        return indice.consultar_abierto(io.BytesIO(datos), self.identidad, len(datos),
+                                        desde, hasta, ultimos, **filtros)
+
+    def valores(self, campo: str) -> List[str]:
+        datos, indice = self._cargar()
+        return indice.valores_abierto(io.BytesIO(datos), self.identidad, len(datos), campo)
+
+    def lineas_al_reves(self) -> Iterator[bytes]:
+        datos, _ = self._cargar()
+        return lineas_al_reves(io.BytesIO(datos))
+
+    def iterar(self) -> Iterator[bytes]:
+        with gzip.open(self.ruta, "rb") as f:
+            yield from f
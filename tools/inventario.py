@@ -1,44 +1,92 @@
 import json
-from typing import Optional
+from typing import List, Optional
 
-from tools.utils import cargar_inventario, guardar_inventario
-from tools.historial import registrar_evento
+from tools.utils import cargar_inventario_indexado, ejecutar_mutacion, obtener_derivado
+from tools.busqueda import IndiceBusqueda
+from tools.historial import registrar_evento, registrar_eventos
 
 
 # ==========================================================
 #   TOOL: LEER PRODUCTO
 # ==========================================================
 
-def leer_producto(file_path: str, query: str, usuario_actual: str = None) -> str:
+CAMPOS_PRODUCTO = ["id", "nombre", "precio", "stock", "categoria"]
+
+# Resultados por página en búsquedas por texto (y máximo permitido)
+LIMITE_RESULTADOS = 20
+LIMITE_MAXIMO = 200
+
+
+def _formatear(productos, campos=None, compacto=False) -> str:
+    if campos:
+        productos = [{c: p.get(c) for c in campos} for p in productos]
+    if compacto:
+        return json.dumps(productos, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(productos, ensure_ascii=False, indent=2)
+
+
+def leer_producto(
+    file_path: str,
+    query: str,
+    usuario_actual: str = None,
+    limit: int = LIMITE_RESULTADOS,
+    offset: int = 0,
+    campos: Optional[List[str]] = None,
+    compacto: bool = False,
+    orden: str = "id",
+) -> str:
     """
     Busca coincidencias por ID exacto o por nombre/categoría si no es un número.
     (No registra historial porque solo es consulta)
+
+    Las búsquedas por texto se devuelven paginadas (`limit`/`offset`) con
+    una línea de cabecera con el total, ordenadas por `orden` (un campo,
+    con "-" delante para orden descendente; empates por ID). `campos`
+    limita los campos devueltos y `compacto` quita la sangría del JSON.
     """
     try:
-        productos, _ = cargar_inventario(file_path)
+        productos, _, indice, _ = cargar_inventario_indexado(file_path)
+
+        campos = [c for c in (campos or []) if c in CAMPOS_PRODUCTO] or None
 
         # Buscar por ID
         if query.isdigit():
             pid = int(query)
-            resultados = [p for p in productos if p.get("id") == pid]
+            producto = indice.get(pid)
 
-            if not resultados:
+            if producto is None:
                 return f"No se encontró el producto con ID {pid}."
 
-            return json.dumps(resultados, ensure_ascii=False, indent=2)
+            return _formatear([producto], campos, compacto)
 
-        # Buscar por nombre o categoría
-        query_lower = query.lower()
-        resultados = [
-            p for p in productos
-            if query_lower in p.get("nombre", "").lower()
-            or query_lower in p.get("categoria", "").lower()
-        ]
+        # Buscar por nombre o categoría (índice de trigramas)
+        busqueda = obtener_derivado(file_path, "busqueda", IndiceBusqueda)
+        ids = [pid for pid in busqueda.buscar(query) if pid in indice]
 
-        if not resultados:
+        if not ids:
             return f"No se encontraron coincidencias con '{query}'."
 
-        return json.dumps(resultados, ensure_ascii=False, indent=2)
+        # Los IDs ya vienen ordenados; otro orden solo ordena las coincidencias
+        campo_orden = orden.lstrip("-")
+        if campo_orden in CAMPOS_PRODUCTO and orden != "id":
+            ids.sort(
+                key=lambda pid: (indice[pid].get(campo_orden), pid),
+                reverse=orden.startswith("-"),
+            )
+
+        limit = max(1, min(int(limit), LIMITE_MAXIMO))
+        offset = max(0, int(offset))
+        total = len(ids)
+        pagina = [indice[pid] for pid in ids[offset:offset + limit]]
+
+        if not pagina:
+            return f"Hay {total} coincidencias con '{query}', ninguna a partir de offset={offset}."
+
+        cabecera = f"Resultados {offset + 1}-{offset + len(pagina)} de {total} para '{query}'"
+        if offset + len(pagina) < total:
+            cabecera += f" (siguiente página: offset={offset + len(pagina)})"
+
+        return cabecera + ":\n" + _formatear(pagina, campos, compacto)
 
     except Exception as e:
         return f"Error al leer productos: {e}"
@@ -58,13 +106,17 @@ def agregar_producto(
     usuario_actual: str = "desconocido",
 ) -> str:
 
-    try:
-        productos, data = cargar_inventario(file_path)
-
+    def _mutar(productos, data, indice):
         # Verificar ID duplicado
-        if any(int(p.get("id")) == int(id) for p in productos):
-            return f"Error: ya existe un producto con ID {id}."
+        if nuevo["id"] in indice:
+            return None, False
 
+        productos.append(nuevo)
+        indice[nuevo["id"]] = nuevo
+        data["productos"] = productos
+        return [nuevo["id"]], True
+
+    try:
         nuevo = {
             "id": int(id),
             "nombre": nombre,
@@ -73,20 +125,21 @@ def agregar_producto(
             "categoria": categoria,
         }
 
-        productos.append(nuevo)
-        data["productos"] = productos
-        guardar_inventario(file_path, data)
-
-        # Registrar todos los campos agregados
-        for campo, valor in nuevo.items():
-            registrar_evento(
-                usuario=usuario_actual,
-                accion="agregar_producto",
-                producto_id=id,
-                campo=campo,
-                valor_anterior=None,
-                valor_nuevo=valor
-            )
+        if not ejecutar_mutacion(file_path, _mutar):
+            return f"Error: ya existe un producto con ID {id}."
+
+        # Registrar todos los campos agregados (una sola escritura)
+        registrar_eventos([
+            {
+                "usuario": usuario_actual,
+                "accion": "agregar_producto",
+                "producto_id": id,
+                "campo": campo,
+                "valor_anterior": None,
+                "valor_nuevo": valor,
+            }
+            for campo, valor in nuevo.items()
+        ])
 
         return (
             "Producto agregado correctamente:\n" +
@@ -111,47 +164,56 @@ def actualizar_producto(
     usuario_actual: str = "desconocido",
 ) -> str:
 
-    try:
-        productos, data = cargar_inventario(file_path)
-
-        producto = next((p for p in productos if int(p.get("id")) == int(id)), None)
+    def _mutar(productos, data, indice):
+        producto = indice.get(int(id))
         if not producto:
-            return f"No existe ningún producto con ID {id}."
+            return None, None
 
         cambios = {}
 
         # Nombre
         if nombre is not None and nombre != producto["nombre"]:
             cambios["nombre"] = {"antes": producto["nombre"], "después": nombre}
-            registrar_evento(usuario_actual, "actualizar_producto", id, "nombre",
-                             producto["nombre"], nombre)
             producto["nombre"] = nombre
 
         # Precio
         if precio is not None and precio != producto["precio"]:
             cambios["precio"] = {"antes": producto["precio"], "después": float(precio)}
-            registrar_evento(usuario_actual, "actualizar_producto", id, "precio",
-                             producto["precio"], float(precio))
             producto["precio"] = float(precio)
 
         # Stock
         if stock is not None and stock != producto["stock"]:
             cambios["stock"] = {"antes": producto["stock"], "después": int(stock)}
-            registrar_evento(usuario_actual, "actualizar_producto", id, "stock",
-                             producto["stock"], int(stock))
             producto["stock"] = int(stock)
 
         # Categoría
         if categoria is not None and categoria != producto["categoria"]:
             cambios["categoria"] = {"antes": producto["categoria"], "después": categoria}
-            registrar_evento(usuario_actual, "actualizar_producto", id, "categoria",
-                             producto["categoria"], categoria)
             producto["categoria"] = categoria
 
+        return ([int(id)] if cambios else None), cambios
+
+    try:
+        cambios = ejecutar_mutacion(file_path, _mutar)
+
+        if cambios is None:
+            return f"No existe ningún producto con ID {id}."
+
         if not cambios:
             return f"No se especificaron cambios para el producto {id}."
 
-        guardar_inventario(file_path, data)
+        # Un único registro para todos los campos modificados
+        registrar_eventos([
+            {
+                "usuario": usuario_actual,
+                "accion": "actualizar_producto",
+                "producto_id": id,
+                "campo": campo,
+                "valor_anterior": cambio["antes"],
+                "valor_nuevo": cambio["después"],
+            }
+            for campo, cambio in cambios.items()
+        ])
 
         return (
             f"Producto {id} actualizado correctamente:\n" +
@@ -173,17 +235,19 @@ def actualizar_stock(
     usuario_actual: str = "desconocido",
 ) -> str:
 
-    try:
-        productos, data = cargar_inventario(file_path)
-
-        producto = next((p for p in productos if int(p.get("id")) == int(id)), None)
+    def _mutar(productos, data, indice):
+        producto = indice.get(int(id))
         if not producto:
-            return f"No existe ningún producto con ID {id}."
+            return None, None
 
         stock_anterior = producto["stock"]
         producto["stock"] = int(stock)
+        return [int(id)], stock_anterior
 
-        guardar_inventario(file_path, data)
+    try:
+        stock_anterior = ejecutar_mutacion(file_path, _mutar)
+        if stock_anterior is None:
+            return f"No existe ningún producto con ID {id}."
 
         registrar_evento(
             usuario=usuario_actual,
@@ -211,17 +275,19 @@ def actualizar_precio(
     usuario_actual: str = "desconocido"
 ) -> str:
 
-    try:
-        productos, data = cargar_inventario(file_path)
-
-        producto = next((p for p in productos if int(p.get("id")) == int(id)), None)
+    def _mutar(productos, data, indice):
+        producto = indice.get(int(id))
         if not producto:
-            return f"No existe ningún producto con ID {id}."
+            return None, None
 
         precio_anterior = producto["precio"]
         producto["precio"] = float(precio)
+        return [int(id)], precio_anterior
 
-        guardar_inventario(file_path, data)
+    try:
+        precio_anterior = ejecutar_mutacion(file_path, _mutar)
+        if precio_anterior is None:
+            return f"No existe ningún producto con ID {id}."
 
         registrar_evento(
             usuario=usuario_actual,
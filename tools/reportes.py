@@ -6,7 +6,7 @@ from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.pagesizes import A4
 
 from tools.utils import cargar_inventario
-from tools.historial import cargar_historial
+from tools.historial import consultar_historial, FORMATO_FECHA
 
 # ==========================================================
 # RUTA CORRECTA DEL PDF (SE GUARDA EN LA RAÍZ DEL PROYECTO)
@@ -27,33 +27,29 @@ def generar_reporte(file_path: str, dias: int = 7) -> str:
     """
 
     productos, _ = cargar_inventario(file_path)
-    historial = cargar_historial()
 
-    cutoff = datetime.now() - timedelta(days=dias)
+    # Las fechas tienen formato fijo "%Y-%m-%d %H:%M:%S": comparar los
+    # textos equivale a comparar las fechas, sin parsear cada evento
+    cutoff = (datetime.now() - timedelta(days=dias)).strftime(FORMATO_FECHA)
 
     # --- Bajo stock ---
     bajo_stock = [p for p in productos if p["stock"] <= 5]
 
-    # --- Productos nuevos ---
-    nuevos = [
-        h for h in historial
-        if h["accion"] == "agregar_producto"
-        and datetime.strptime(h["fecha"], "%Y-%m-%d %H:%M:%S") >= cutoff
-    ]
-
-    # --- Movimientos de stock ---
-    movimientos_stock = [
-        h for h in historial
-        if h["accion"] == "actualizar_stock"
-        and datetime.strptime(h["fecha"], "%Y-%m-%d %H:%M:%S") >= cutoff
-    ]
-
-    # --- Cambios de precio ---
-    cambios_precio = [
-        h for h in historial
-        if h.get("campo") == "precio"
-        and datetime.strptime(h["fecha"], "%Y-%m-%d %H:%M:%S") >= cutoff
-    ]
+    # Solo los eventos del periodo (búsqueda binaria en el índice por fecha)
+    historial = consultar_historial(desde=cutoff)
+
+    # --- Productos nuevos / movimientos de stock / cambios de precio ---
+    nuevos = []
+    movimientos_stock = []
+    cambios_precio = []
+
+    for h in historial:
+        if h["accion"] == "agregar_producto":
+            nuevos.append(h)
+        elif h["accion"] == "actualizar_stock":
+            movimientos_stock.append(h)
+        if h.get("campo") == "precio":
+            cambios_precio.append(h)
 
     # =====================================================
     #   GENERAR PDF
@@ -1,5 +1,45 @@
 import json
-from typing import Tuple, Dict, Any, List
+import os
+import random
+import threading
+import time
+from typing import Tuple, Dict, Any, List, Optional, Iterable, Callable
+
+from tools.almacenamiento import obtener_almacenamiento, ConflictoVersion
+
+# ==========================================================
+#   CACHÉ EN MEMORIA DEL INVENTARIO
+# ==========================================================
+# Cada archivo se parsea una sola vez mientras no cambie en disco.
+# La clave es (motor, ruta absoluta) y el "sello" de versión lo da el
+# motor de almacenamiento: (dispositivo, inodo, mtime en ns, tamaño) para
+# JSON, el contador de versión para SQLite. Cualquier escritura, propia o
+# de otro proceso, produce un sello distinto.
+#
+# La estructura devuelta es COMPARTIDA entre llamadas: quien la
+# modifique debe persistirla con guardar_inventario() o descartar
+# los cambios con invalidar_cache().
+
+_cache: Dict[str, Dict[str, Any]] = {}
+_cache_lock = threading.Lock()
+_estadisticas = {"aciertos": 0, "fallos": 0, "invalidaciones": 0, "conflictos": 0}
+
+# Reintentos de una mutación cuando otro proceso guardó antes que nosotros
+REINTENTOS_MUTACION = 5
+
+# Mutex por archivo para los hilos de este proceso (la estructura en caché
+# es compartida). Entre procesos la concurrencia es optimista.
+_mutex_archivos: Dict[Tuple[str, str], threading.RLock] = {}
+
+
+def _clave(file_path: str) -> Tuple[str, str]:
+    return (obtener_almacenamiento().nombre, os.path.abspath(file_path))
+
+
+def _mutex(clave: Tuple[str, str]) -> threading.RLock:
+    with _cache_lock:
+        return _mutex_archivos.setdefault(clave, threading.RLock())
+
 
 def cargar_inventario(file_path: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
     """
@@ -15,21 +55,371 @@ def cargar_inventario(file_path: str) -> Tuple[List[Dict[str, Any]], Dict[str, A
             {...}
         ]
     }
+
+    Si el archivo no ha cambiado desde la última lectura se devuelve
+    la versión ya parseada de la caché, sin volver a leerlo.
     """
+    productos, data, _ = _cargar(file_path)
+    return productos, data
+
+
+def _cargar(file_path: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any], Any]:
+    # Como cargar_inventario(), devolviendo además el sello de la versión
+    # cargada (el de disco cuando se leyó, no el de la caché en otro momento)
+    motor = obtener_almacenamiento()
+    clave = _clave(file_path)
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        sello = motor.sello(clave[1])
+
+        with _cache_lock:
+            entrada = _cache.get(clave)
+            if entrada is not None and entrada["sello"] == sello:
+                _estadisticas["aciertos"] += 1
+                data = entrada["data"]
+                return data.get("productos", []), data, sello
+            _estadisticas["fallos"] += 1
+
+        data = motor.cargar(clave[1])
+
+        with _cache_lock:
+            _cache[clave] = {"sello": sello, "data": data, "indice": None,
+                             "derivados": {}, "posiciones": None}
+
         productos = data.get("productos", [])
-        return productos, data
-    except FileNotFoundError:
+        return productos, data, sello
+    except FileNotFoundError as e:
+        # Los motores avisan con su propio mensaje (p. ej. SQLite sin migrar)
+        if e.errno is None:
+            raise
         raise FileNotFoundError(f"El archivo '{file_path}' no existe.")
     except json.JSONDecodeError:
         raise ValueError(f"El archivo '{file_path}' no contiene JSON válido.")
 
 
-def guardar_inventario(file_path: str, data: Dict[str, Any]) -> None:
+def version_inventario(file_path: str) -> Tuple:
+    """
+    Sello de la versión actual del inventario, sin cargarlo. Cambia con
+    cada escritura; sirve como clave de cachés externas (UI, instantáneas).
+    """
+    return obtener_almacenamiento().sello(os.path.abspath(file_path))
+
+
+def guardar_inventario(
+    file_path: str,
+    data: Dict[str, Any],
+    modificados: Optional[Iterable[int]] = None,
+    sello_esperado: Any = None,
+) -> None:
+    """
+    Guarda el inventario modificado con el motor de almacenamiento activo.
+
+    `modificados` son los IDs de los productos insertados o cambiados; el
+    motor SQLite escribe solo esas filas (el JSON siempre se reescribe
+    completo). Sin él se guarda el inventario entero.
+    La caché se actualiza con los datos recién escritos.
+
+    `sello_esperado` es el sello con el que se cargó `data` (lo devuelve
+    cargar_inventario_indexado). Si el archivo ya no tiene ese sello, o
+    la entrada de caché se sustituyó entretanto por otra lectura, se lanza
+    ConflictoVersion (ver ejecutar_mutacion para reintentar). Sin él, la
+    comprobación solo se hace si `data` sigue siendo la estructura en caché.
+    """
+    _guardar(file_path, data, modificados, sello_esperado, base=data)
+
+
+def _guardar(
+    file_path: str,
+    data: Dict[str, Any],
+    modificados: Optional[Iterable[int]],
+    sello_esperado: Any,
+    base: Dict[str, Any],
+    indice: Optional[Dict[int, Dict[str, Any]]] = None,
+) -> None:
+    # `base` es la estructura de la caché de la que sale `data`: la misma
+    # si se modificó en sitio, o la original de un borrador (ver
+    # ejecutar_mutacion), con su `indice` ya preparado
+    motor = obtener_almacenamiento()
+    clave = _clave(file_path)
+
+    with _cache_lock:
+        anterior = _cache.get(clave)
+        derivados = {}
+        posiciones = None
+        en_cache = anterior is not None and anterior["data"] is base
+        # Otra lectura sustituyó la entrada: `data` puede no ser ya la
+        # versión de disco y guardarla pisaría lo que se escribió después
+        conflicto = sello_esperado is not None and not (en_cache and anterior["sello"] == sello_esperado)
+        if conflicto:
+            _estadisticas["conflictos"] += 1
+        # Si se guarda la misma estructura que estaba en caché, su índice
+        # sigue siendo válido (los llamadores lo mantienen al insertar)
+        elif en_cache:
+            sello_esperado = anterior["sello"]
+            if indice is None:
+                indice = anterior["indice"]
+            derivados = anterior["derivados"]
+            posiciones = anterior["posiciones"]
+    if indice is not None and len(indice) != len(data.get("productos", [])):
+        indice = None
+
+    if conflicto:
+        raise ConflictoVersion(
+            f"El inventario '{file_path}' se recargó mientras se modificaba."
+        )
+
+    registros = None
+    if modificados is not None:
+        if indice is None:
+            indice = construir_indice(data.get("productos", []))
+        registros = [indice[int(pid)] for pid in modificados]
+
+    try:
+        sello = motor.guardar(clave[1], data, registros, sello_esperado=sello_esperado)
+    except ConflictoVersion:
+        with _cache_lock:
+            _estadisticas["conflictos"] += 1
+        if base is data:
+            invalidar_cache(file_path)
+        raise
+    except Exception:
+        # Un borrador no tocó la caché; una estructura modificada en
+        # sitio ya no coincide con el disco
+        if base is data:
+            invalidar_cache(file_path)
+        raise
+
+    # Las estructuras derivadas se actualizan solo con lo que cambió;
+    # tras un guardado completo se reconstruirán cuando se pidan
+    if registros is None:
+        derivados = {}
+        posiciones = None
+    else:
+        for derivado in derivados.values():
+            derivado.actualizar(registros)
+
+    with _cache_lock:
+        _cache[clave] = {"sello": sello, "data": data, "indice": indice,
+                         "derivados": derivados, "posiciones": posiciones}
+
+
+_FALTA = object()
+
+
+class _IndiceBorrador:
+    """
+    Índice ID → producto de un borrador: cada producto que se pide se
+    copia la primera vez, así que modificarlo no toca el de la caché.
+    Admite lo que usan las mutaciones: get, [], in, asignación y len.
+    """
+
+    def __init__(self, base: Dict[int, Dict[str, Any]]):
+        self._base = base
+        self.copias: Dict[int, Dict[str, Any]] = {}
+
+    def get(self, pid, default=None):
+        if pid in self.copias:
+            return self.copias[pid]
+        producto = self._base.get(pid)
+        if producto is None:
+            return default
+        copia = self.copias[pid] = dict(producto)
+        return copia
+
+    def __getitem__(self, pid):
+        producto = self.get(pid, _FALTA)
+        if producto is _FALTA:
+            raise KeyError(pid)
+        return producto
+
+    def __contains__(self, pid) -> bool:
+        return pid in self.copias or pid in self._base
+
+    def __setitem__(self, pid, producto) -> None:
+        self.copias[pid] = producto
+
+    def __len__(self) -> int:
+        return len(self._base) + sum(1 for pid in self.copias if pid not in self._base)
+
+
+def _posiciones(clave: Tuple[str, str], data: Dict[str, Any]) -> Dict[int, int]:
+    # ID → posición en la lista de productos, una vez por versión cargada.
+    # Las posiciones no cambian entre versiones: los productos solo se
+    # añaden al final (ejecutar_mutacion la mantiene)
+    with _cache_lock:
+        entrada = _cache.get(clave)
+        if entrada is not None and entrada["data"] is data and entrada["posiciones"] is not None:
+            return entrada["posiciones"]
+
+    posiciones = {int(p.get("id")): i for i, p in enumerate(data.get("productos", []))}
+    with _cache_lock:
+        if entrada is not None and entrada["data"] is data:
+            entrada["posiciones"] = posiciones
+    return posiciones
+
+
+def ejecutar_mutacion(
+    file_path: str,
+    mutacion: Callable[[List[Dict[str, Any]], Dict[str, Any], Dict[int, Dict[str, Any]]], Tuple[Optional[Iterable[int]], Any]],
+    reintentos: int = REINTENTOS_MUTACION,
+) -> Any:
+    """
+    Aplica una modificación al inventario con control de versión optimista.
+
+    `mutacion(productos, data, indice)` modifica la estructura y devuelve
+    (modificados, resultado): los IDs que hay que guardar (vacío o None si
+    no hubo cambios) y el valor que se devolverá al llamador. Si otro
+    proceso guarda el inventario entre la carga y la escritura, los
+    cambios se descartan y la mutación se repite sobre los datos nuevos.
+    Por eso `mutacion` no debe tener efectos fuera del inventario.
+
+    La mutación trabaja sobre un borrador: una copia de la lista y de
+    `data`, y un índice que copia cada producto que se pide. Los
+    productos se modifican a través de `indice` y los nuevos se añaden al
+    final de `productos` (y a `indice`). Los lectores siguen viendo la
+    versión en caché hasta que el guardado termina bien; si falla, la
+    caché queda intacta.
+    """
+    clave = _clave(file_path)
+    mutex = _mutex(clave)
+
+    for intento in range(reintentos):
+        with mutex:
+            productos, data, indice, sello = cargar_inventario_indexado(file_path)
+
+            borrador_productos = list(productos)
+            borrador_data = {**data, "productos": borrador_productos}
+            borrador_indice = _IndiceBorrador(indice)
+
+            modificados, resultado = mutacion(borrador_productos, borrador_data, borrador_indice)
+            if not modificados:
+                return resultado
+
+            # Sustituir en la lista del borrador los productos copiados
+            lista = borrador_data.get("productos", borrador_productos)
+            posiciones = _posiciones(clave, data)
+            for pid, copia in borrador_indice.copias.items():
+                original = indice.get(pid)
+                if original is None:
+                    continue  # producto nuevo: la mutación ya lo añadió
+                pos = posiciones.get(pid)
+                if pos is None or pos >= len(lista) or lista[pos] is not original:
+                    posiciones = {int(p.get("id")): i for i, p in enumerate(productos)}
+                    pos = posiciones[pid]
+                lista[pos] = copia
+
+            nuevo_indice = dict(indice)
+            nuevo_indice.update(borrador_indice.copias)
+
+            try:
+                _guardar(file_path, borrador_data, modificados, sello,
+                         base=data, indice=nuevo_indice)
+            except ConflictoVersion:
+                pass
+            else:
+                # Posiciones de los productos añadidos al final
+                for i in range(len(productos), len(lista)):
+                    posiciones[int(lista[i].get("id"))] = i
+                with _cache_lock:
+                    entrada = _cache.get(clave)
+                    if entrada is not None and entrada["data"] is borrador_data:
+                        entrada["posiciones"] = posiciones
+                return resultado
+
+        # Pequeña espera aleatoria para no chocar otra vez con el mismo proceso
+        time.sleep(random.uniform(0, 0.02 * (intento + 1)))
+
+    raise ConflictoVersion(
+        f"No se pudo guardar '{file_path}' tras {reintentos} intentos: "
+        f"el inventario cambia demasiado rápido."
+    )
+
+
+def construir_indice(productos: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """
+    Construye un índice ID → producto. Los valores son los mismos
+    diccionarios de la lista, así que modificar un producto encontrado
+    por el índice modifica también el inventario.
+    """
+    return {int(p.get("id")): p for p in productos}
+
+
+def cargar_inventario_indexado(
+    file_path: str,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any], Dict[int, Dict[str, Any]], Any]:
+    """
+    Igual que cargar_inventario(), pero devuelve además el índice por ID
+    y el sello de la versión cargada.
+
+    El índice se construye una sola vez por versión cargada del archivo.
+    Quien inserte productos en la lista debe añadirlos también al índice
+    (indice[id] = producto) antes de llamar a guardar_inventario(), y
+    pasarle el sello como `sello_esperado`.
+    """
+    productos, data, sello = _cargar(file_path)
+
+    with _cache_lock:
+        entrada = _cache.get(_clave(file_path))
+        if entrada is not None and entrada["data"] is data:
+            if entrada["indice"] is None:
+                entrada["indice"] = construir_indice(productos)
+            return productos, data, entrada["indice"], sello
+
+    return productos, data, construir_indice(productos), sello
+
+
+def obtener_derivado(file_path: str, nombre: str, constructor: Callable[[List[Dict[str, Any]]], Any]) -> Any:
+    """
+    Devuelve una estructura derivada del inventario (índice de búsqueda,
+    estadísticas...) construida una sola vez por versión cargada.
+
+    `constructor(productos)` crea la estructura, que debe ofrecer un
+    método actualizar(productos_modificados); guardar_inventario() lo
+    llama con los productos insertados o cambiados.
+    """
+    clave = _clave(file_path)
+
+    while True:
+        productos, data, sello = _cargar(file_path)
+
+        with _cache_lock:
+            entrada = _cache.get(clave)
+            if entrada is None or entrada["data"] is not data:
+                entrada = None
+            elif nombre in entrada["derivados"]:
+                return entrada["derivados"][nombre]
+
+        # Se construye sin el mutex de escritura: una versión publicada no
+        # cambia, las mutaciones trabajan sobre un borrador
+        derivado = constructor(productos)
+        if entrada is None:
+            return derivado
+
+        # Se instala con el mutex tomado para no colarse entre el guardado
+        # de una mutación y la actualización de sus derivados; si entretanto
+        # se publicó otra versión, se construye de nuevo sobre ella
+        with _mutex(clave), _cache_lock:
+            actual = _cache.get(clave)
+            if actual is not None and actual["data"] is data and actual["sello"] == sello:
+                return actual["derivados"].setdefault(nombre, derivado)
+
+
+def invalidar_cache(file_path: Optional[str] = None) -> None:
+    """
+    Descarta la entrada de caché de un archivo (o todas si no se indica
+    ninguno). Útil cuando se modificó la estructura sin guardarla.
+    """
+    with _cache_lock:
+        if file_path is None:
+            _cache.clear()
+        else:
+            _cache.pop(_clave(file_path), None)
+        _estadisticas["invalidaciones"] += 1
+
+
+def estadisticas_cache() -> Dict[str, int]:
     """
-    Guarda el inventario modificado en el archivo JSON.
+    Devuelve los contadores de la caché: aciertos, fallos, invalidaciones,
+    conflictos de versión y número de archivos en memoria.
     """
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    with _cache_lock:
+        return {**_estadisticas, "entradas": len(_cache)}